@@ -17,9 +17,11 @@ def before_first_request():
 # no worker
 def complex_task(seconds):
     import time
+    from flask_worker import report_progress
     print('Complex task started')
     for i in range(seconds):
         print('Progress: {}%'.format(100.0*i/seconds))
+        report_progress(i/seconds)
         time.sleep(1)
     print('Progress: 100.0%')
     print('Complex task finished')
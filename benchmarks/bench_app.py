@@ -0,0 +1,71 @@
+"""Benchmark application
+
+A minimal Flask-Worker application with an SQLite database, a Redis queue 
+(fakeredis unless a Redis URL is given), and a no-op Socket.IO stand-in, so 
+benchmarks measure Flask-Worker rather than the network.
+"""
+
+from flask_worker import Manager, RouterMixin, WorkerMixin, set_route
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from rq import Queue
+import os
+
+
+class NullSocketIO():
+    def emit(self, *args, **kwargs):
+        pass
+
+    def on(self, *args, **kwargs):
+        return lambda func: func
+
+
+db = SQLAlchemy()
+manager = Manager(
+    db=db, socketio=NullSocketIO(), app_import='bench_app.app'
+)
+
+def connect(redis_url=None):
+    if redis_url:
+        from redis import Redis
+        return Redis.from_url(redis_url)
+    import fakeredis
+    return fakeredis.FakeStrictRedis()
+
+def create_app(redis_url=None, db_path=None):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + (
+        db_path or os.path.join(os.getcwd(), 'bench.db')
+    )
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.redis = connect(redis_url)
+    app.task_queue = Queue('bench', connection=app.redis)
+    db.init_app(app)
+    manager.init_app(app)
+    return app
+
+# the application is configured by run.py before jobs are executed
+app = None
+
+
+class Worker(WorkerMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+
+
+class Router(RouterMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+
+    def __init__(self, payload):
+        super().__init__(self.start, payload)
+
+    def start(self, payload):
+        return self.bookmarked(payload)
+
+    @set_route
+    def bookmarked(self, payload):
+        return ''
+
+
+def noop(payload):
+    return None
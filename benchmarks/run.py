@@ -0,0 +1,195 @@
+"""Benchmarks
+
+Measures Flask-Worker's enqueue, dispatch, and notification paths:
+
+1. Enqueue throughput, one worker at a time and with `Manager.enqueue_many`.
+2. End-to-end latency of no-op jobs executed by an rq `SimpleWorker`.
+3. Job status checks per second, single and bulk.
+4. Router call overhead.
+
+Each benchmark runs for every combination of worker count and payload size. 
+Results are printed (or written to `--output`) as JSON so runs can be 
+compared.
+
+```
+$ python benchmarks/run.py --workers 10 100 --payloads 10 10000
+$ python benchmarks/run.py --redis-url redis://localhost:6379/15
+```
+
+Flask-Worker must be importable (e.g. `pip install -e .`), as must rq, 
+Flask-SQLAlchemy, and fakeredis (unless `--redis-url` is given). Use a 
+dedicated Redis database; the benchmarks flush it.
+"""
+
+import bench_app
+from bench_app import Router, Worker, db, noop
+
+from flask_worker import SimpleAppWorker
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def summarize(durations):
+    durations = sorted(durations)
+    return dict(
+        mean=statistics.mean(durations),
+        p50=durations[len(durations)//2],
+        p95=durations[min(int(len(durations)*.95), len(durations)-1)],
+        max=durations[-1]
+    )
+
+def reset(app):
+    app.redis.flushdb()
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+
+def run_worker(app):
+    SimpleAppWorker([app.task_queue], connection=app.redis).work(
+        burst=True, logging_level='WARNING'
+    )
+
+def bench_enqueue(app, n_workers, payload):
+    with app.test_request_context('/'):
+        reset(app)
+        workers = [Worker() for _ in range(n_workers)]
+        db.session.add_all(workers)
+        db.session.commit()
+        single = timed(
+            lambda: [w.enqueue_function(noop, payload) for w in workers]
+        )
+        reset(app)
+        workers = [Worker() for _ in range(n_workers)]
+        batch = timed(lambda: app.extensions['manager'].enqueue_many(
+            [(w, noop, (payload,), {}) for w in workers]
+        ))
+    return dict(
+        single_jobs_per_second=n_workers/single,
+        batch_jobs_per_second=n_workers/batch
+    )
+
+def bench_latency(app, n_workers, payload):
+    with app.test_request_context('/'):
+        reset(app)
+        workers = [Worker() for _ in range(n_workers)]
+        app.extensions['manager'].enqueue_many(
+            [(w, noop, (payload,), {}) for w in workers]
+        )
+        job_ids = [w.job_id for w in workers]
+    start = time.perf_counter()
+    run_worker(app)
+    elapsed = time.perf_counter() - start
+    from rq.job import Job
+    jobs = Job.fetch_many(job_ids, connection=app.redis)
+    latencies = [
+        (job.ended_at - job.enqueued_at).total_seconds() for job in jobs
+    ]
+    return dict(
+        jobs_per_second=n_workers/elapsed, latency=summarize(latencies)
+    )
+
+def bench_status(app, n_workers, payload, repeat=200):
+    with app.test_request_context('/'):
+        reset(app)
+        workers = [Worker() for _ in range(n_workers)]
+        app.extensions['manager'].enqueue_many(
+            [(w, noop, (payload,), {}) for w in workers]
+        )
+        job_ids = [w.job_id for w in workers]
+    client = app.test_client()
+    single = timed(lambda: [
+        client.get('/_check_job_status?job_id='+job_ids[i % n_workers])
+        for i in range(repeat)
+    ])
+    query = [('job_id', job_id) for job_id in job_ids]
+    bulk = timed(lambda: [
+        client.get('/_check_jobs_status', query_string=query)
+        for i in range(repeat)
+    ])
+    return dict(
+        single_requests_per_second=repeat/single,
+        bulk_requests_per_second=repeat/bulk,
+        bulk_job_ids_per_request=n_workers
+    )
+
+def bench_router(app, n_routers, payload):
+    with app.test_request_context('/'):
+        reset(app)
+        routers = [Router(payload) for _ in range(n_routers)]
+        # first call bookmarks the route and inserts the router
+        first = timed(lambda: [router() for router in routers])
+        ids = [router.id for router in routers]
+    with app.test_request_context('/'):
+        routers = Router.query.filter(Router.id.in_(ids)).all()
+        repeat = timed(lambda: [router() for router in routers])
+    return dict(
+        first_call_seconds=first/n_routers, 
+        repeat_call_seconds=repeat/n_routers
+    )
+
+BENCHMARKS = dict(
+    enqueue=bench_enqueue, 
+    latency=bench_latency, 
+    status=bench_status, 
+    router=bench_router
+)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--redis-url', default=None)
+    parser.add_argument(
+        '--workers', type=int, nargs='+', default=[1, 10, 100]
+    )
+    parser.add_argument(
+        '--payloads', type=int, nargs='+', default=[10, 10000, 100000],
+        help='payload sizes in bytes'
+    )
+    parser.add_argument(
+        '--benchmarks', nargs='+', choices=BENCHMARKS, 
+        default=list(BENCHMARKS)
+    )
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    db_dir = tempfile.mkdtemp()
+    app = bench_app.app = bench_app.create_app(
+        args.redis_url, os.path.join(db_dir, 'bench.db')
+    )
+    results = []
+    for name in args.benchmarks:
+        for n_workers in args.workers:
+            for size in args.payloads:
+                result = BENCHMARKS[name](app, n_workers, 'x'*size)
+                results.append(dict(
+                    benchmark=name, workers=n_workers, payload_bytes=size, 
+                    **result
+                ))
+                print(
+                    name, n_workers, size, json.dumps(result), file=sys.stderr
+                )
+    report = dict(
+        python=platform.python_version(), 
+        redis='fakeredis' if args.redis_url is None else args.redis_url,
+        results=results
+    )
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,155 @@
 """# Manager"""
 
-from flask_worker.router_mixin import RouterMixin, set_route
-from flask_worker.worker_mixin import WorkerMixin
+from flask_worker.admission import Admission, Overloaded
+from flask_worker.chains import (
+    Step, chain_job_ids, new_chain_id, resolve_steps
+)
+from flask_worker.cli import worker_cli
+from flask_worker.emitter import Emitter, channel, connection_url
+from flask_worker.executors import (
+    AsyncioExecutor, RQExecutor, ThreadExecutor
+)
+from flask_worker.maps import MapState, chunks, is_map_id, new_map_id
+from flask_worker.memo import Memo, call_hash
+from flask_worker.metrics import DEFAULT_BUCKETS, Metrics, job_name
+from flask_worker.pool import PoolWorker, WorkerPool
+from flask_worker.recovery import Reaper
+from flask_worker.results import FileResultStore, RedisResultStore
+from flask_worker.router_mixin import (
+    JSONRouterMixin, RouterMixin, set_route
+)
+from flask_worker.rq_worker import (
+    AppWorker, SimpleAppWorker, WeightedAppWorker, WeightedSimpleAppWorker
+)
+from flask_worker.state import RedisWorkerState, StateFlusher
+from flask_worker.tasks import JobCancelled, check_cancelled, report_progress
+from flask_worker.worker_mixin import WorkerMixin, eager_load
 
-from flask import Blueprint, current_app, request, url_for
-import rq
+from flask import (
+    Blueprint, Response, abort, current_app, jsonify, render_template, 
+    request, url_for
+)
+from markupsafe import escape
+from redis.exceptions import ResponseError
+from rq import Queue, Worker
+from rq.job import Job, JobStatus
+from sqlalchemy.inspection import inspect
+from werkzeug.routing import BuildError
+
+import hashlib
+import json
+import math
+import os
+import time
+from uuid import uuid4
 
 default_settings = dict(
+    abandon_after=None,
+    admission_key=None,
+    admission_ttl=3600,
     app_import='app.app',
+    cancel_check_interval=1,
+    collect_metrics=False,
     connection=None,
     db=None,
+    deduplicate=False,
+    deduplicate_ttl=3600,
+    detached_jobs=False,
+    executor='rq',
+    executor_workers=4,
+    heartbeat_interval=None,
+    key_limit=None,
     loading_img_src=None,
     loading_img_blueprint=None,
     loading_img_filename='worker_loading.gif',
+    metrics_buckets=None,
+    memoize=False,
+    memoize_max_entries=10000,
+    memoize_ttl=3600,
+    message_queue=None,
+    overload_queue=None,
+    overload_response=None,
+    progress_rate=2,
+    queue_limits=None,
+    queue_weights=None,
+    reaper_max_retries=3,
+    result_backend=None,
+    result_compression=None,
+    result_dir='flask_worker_results',
+    result_ttl=86400,
     socketio=None,
-    template='worker/worker.html'
+    socketio_channel='flask-socketio',
+    socketio_namespace='/flask-worker',
+    sse_keepalive=15,
+    sse_timeout=60,
+    state_backend=None,
+    state_flush_interval=5,
+    state_ttl=86400,
+    status_max_age=1,
+    template='worker/worker.html',
+    transport='socketio'
+)
+
+# settings with which detached jobs build their manager
+DETACHED_SETTINGS = (
+    'abandon_after', 'admission_ttl', 'cancel_check_interval', 'deduplicate', 
+    'heartbeat_interval', 'key_limit', 'memoize', 'memoize_max_entries', 
+    'memoize_ttl', 'message_queue', 'progress_rate', 'queue_limits', 
+    'result_backend', 'result_compression', 'result_dir', 'result_ttl', 
+    'socketio_channel', 'socketio_namespace', 'state_backend', 'state_ttl', 
+    'transport'
 )
 
+# job statuses which will not change
+FINAL_STATUSES = ('finished', 'failed')
+
+# path of the loading page script
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), 'static', 'worker.js')
+# seconds for which clients may cache the (versioned) loading page script
+SCRIPT_MAX_AGE = 31536000
+# seconds after which overloaded clients are asked to retry, if the wait 
+# for the queue cannot be estimated
+OVERLOAD_RETRY_AFTER = 10
+
+
+def format_event(event, data=None):
+    # format a server-sent event
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+def worker_classes():
+    """
+    Returns
+    -------
+    classes : dict
+        Maps table names to the mapped worker classes stored in them.
+    """
+    classes, subclasses = {}, WorkerMixin.__subclasses__()
+    while subclasses:
+        cls = subclasses.pop(0)
+        if getattr(cls, '__table__', None) is not None:
+            classes.setdefault(cls.__tablename__, cls)
+        subclasses += cls.__subclasses__()
+    return classes
+
+
+class ShellWorker():
+    """
+    Stands in for a worker when the default loading page is precompiled. 
+    Worker-specific values are rendered as placeholders, which are 
+    substituted for each worker.
+    """
+    fields = ('model_id', 'job_id', 'callback', 'loading_img_src')
+
+    def __init__(self, manager):
+        self.manager = manager
+        for field in self.fields:
+            setattr(self, field, self.placeholder(field))
+
+    @staticmethod
+    def placeholder(field):
+        return '__flask_worker_{}__'.format(field)
+
 
 class Manager():
     """
@@ -38,11 +171,44 @@ class Manager():
 
     Attributes
     ----------
+    abandon_after : float or None, default=None
+        Number of seconds after which a worker's job is cancelled if no 
+        client is on its loading page. Loading pages send a heartbeat every 
+        third of this period, over the socket or the server-sent event 
+        stream. Queued jobs whose worker was abandoned are skipped when they 
+        are dequeued, and running jobs stop at their next 
+        `flask_worker.check_cancelled` call. If `None`, jobs are never 
+        abandoned.
+
+    admission : flask_worker.Admission or None
+        In-flight job limits created from the `queue_limits` and `key_limit` 
+        settings. See `flask_worker.admission`.
+
+    admission_key : callable or None, default=None
+        Called with a worker whose job is being enqueued. Returns the key, 
+        e.g. the id of the current user, whose in-flight jobs are limited 
+        by `key_limit`, or `None` if the job is not limited per key.
+
+    admission_ttl : int, default=3600
+        Number of seconds after which an in-flight job which was never 
+        released, e.g. because its `rq` worker died, stops counting towards 
+        the in-flight limits.
+
     app_import : str, default='app.app'
         Pythonic import path for the Flask application. e.g. if your 
         application object is created in a file `path/to/app.py` and named 
         `my_app`, set the `app_import` to `path.to.app.my_app`.
 
+    cancel_check_interval : float, default=1
+        Minimum number of seconds between the checks for cancellation made 
+        by `flask_worker.check_cancelled` in a job.
+
+    collect_metrics : bool, default=False
+        Indicates that every job's phases are timed. The timings are stored 
+        in the job's meta, aggregated into histograms with per-function job 
+        counters, and exported in the Prometheus text format by the 
+        `_worker_metrics` view function. See `flask_worker.metrics`.
+
     connection : redis.client.Redis
         Redis connection for the workers. If not explicitly set, the manager 
         will set the connection attribute to the app's `redis` attribute. In 
@@ -52,6 +218,49 @@ class Manager():
     db : flask_sqlalchemy.SQLAlchemy
        Database for the flask application.
 
+    deduplicate : bool, default=False
+        Indicates that duplicate jobs are not enqueued. A job's id is derived 
+        from the worker's `model_id`, the task, and its arguments, and 
+        claimed atomically in Redis. A request which enqueues the same job 
+        while the claim is held attaches its worker to the existing job. The 
+        claim is released when the job finishes.
+
+    deduplicate_ttl : int, default=3600
+        Number of seconds after which a claim expires, e.g. if its job 
+        failed.
+
+    detached_jobs : bool, default=False
+        Indicates that functions enqueued with `WorkerMixin.enqueue_function` 
+        run without loading the application. The job receives the manager's 
+        settings, connects to the Redis server of the `connection` for 
+        states, results, claims and heartbeats, and notifies clients with a 
+        `flask_worker.emitter.Emitter` on the `message_queue`. Requires a 
+        `message_queue`, the `'redis'` `state_backend`, and a `connection` 
+        reachable by URL. Detached jobs do not collect metrics. Local 
+        executors ignore this setting.
+
+    emitter : flask_worker.emitter.Emitter or None
+        Emitter created from the `message_queue` setting.
+
+    executor : str or object, default='rq'
+        Executes workers' tasks. `'rq'` sends them to the app's Redis queue, 
+        `current_app.task_queue`. `'thread'` runs them in a thread pool and 
+        `'asyncio'` on an asyncio event loop, both inside the web process. 
+        You can also pass an executor object; see `flask_worker.executors`.
+
+    executor_workers : int, default=4
+        Number of threads of the `'thread'` and `'asyncio'` executors.
+
+    heartbeat_interval : float or None, default=None
+        Number of seconds between the heartbeats of running jobs. A started 
+        job whose heartbeat has not been refreshed for three intervals is 
+        considered stuck by `reap_stuck_jobs`. If `None`, jobs do not send 
+        heartbeats, and only failed and missing jobs are considered stuck.
+
+    key_limit : int or None, default=None
+        Maximum number of in-flight jobs per `admission_key`. If `None`, 
+        jobs are not limited per key.
+
     loading_img_blueprint : str or None, default=None
         Name of the blueprint to which the loading image belongs. If `None`, 
         the loading image is assumed to be in the app's `static` directory.
@@ -64,14 +273,158 @@ class Manager():
         Loading image source path, derived from `loading_img_blueprint` and 
         `loading_img_filename`.
 
+    memo : flask_worker.Memo or None
+        Memoization cache created from the `memoize` settings.
+
+    memoize : bool, default=False
+        Indicates that the results of functions enqueued with 
+        `WorkerMixin.enqueue_function` are cached, keyed on the function's 
+        import path and its arguments. On a cache hit, the worker is 
+        finished immediately with the cached result and no job is enqueued. 
+        Requires a `result_backend`.
+
+    memoize_max_entries : int or None, default=10000
+        Maximum number of cached results. The least recently used results 
+        are evicted first.
+
+    memoize_ttl : int or None, default=3600
+        Number of seconds for which cached results are kept.
+
+    message_queue : str or None, default=None
+        Redis URL of the Flask-SocketIO message queue, i.e. the 
+        `message_queue` passed to `flask_socketio.SocketIO`. If set, 
+        notifications are written to the message queue directly with a 
+        pooled `flask_worker.emitter.Emitter`, rather than through the 
+        `socketio` object. With the `'sse'` transport, this must be the Redis 
+        server of the `connection`.
+
+    metrics : flask_worker.Metrics or None
+        Metrics created from the `collect_metrics` setting.
+
+    metrics_buckets : tuple of float or None, default=None
+        Upper bounds of the metrics histogram buckets, in seconds. If `None`, 
+        `flask_worker.metrics.DEFAULT_BUCKETS` are used.
+
+    overload_queue : str or None, default=None
+        Name of a lower-priority queue to which jobs are shed when an 
+        in-flight limit is hit. The job must then be admitted to the 
+        overload queue, whose limit is set in `queue_limits`, and the 
+        `key_limit` still applies. Requires the `'rq'` executor. If `None`, 
+        or if the job is not admitted to the overload queue, the client 
+        gets the overload response.
+
+    overload_response : callable or None, default=None
+        Called with a worker whose job was not admitted. Returns the 
+        response to the client. If `None`, the client gets a 503 response 
+        with a `Retry-After` header set to the estimated wait for the queue.
+
+    progress_rate : float, default=2
+        Maximum number of progress reports per second sent for each job. 
+        See `flask_worker.report_progress`.
+
+    queue_limits : dict or None, default=None
+        Maps queue names to their maximum number of in-flight jobs, i.e. 
+        jobs enqueued and not yet finished, failed, or cancelled. Requires 
+        the `'rq'` executor. If `None`, queues are not limited.
+
+    queue_names : list of str
+        Names of the app's task queue and of the queues in `queue_weights`, 
+        from the highest weight to the lowest.
+
+    queue_weights : dict or None, default=None
+        Maps the names of queues to the weights with which workers drain 
+        them, e.g. priority classes such as `{'interactive': 6, 'bulk': 3, 
+        'background': 1}`. Workers declare their queue with 
+        `WorkerMixin.job_queue`. The weights are used by `flask worker 
+        pool` and can be given to `flask_worker.WeightedAppWorker`. Queues 
+        share the connection pool of the app's task queue; see `get_queue`.
+
+    reaper_max_retries : int, default=3
+        Number of times `reap_stuck_jobs` recovers a worker's stuck jobs, 
+        without a job finishing in between, before giving up. The worker is 
+        then reset and its clients receive a `job_failed` event.
+
+    result_backend : str or None, default=None
+        Where the results of workers' jobs are stored. `'redis'` stores them 
+        in Redis and `'file'` stores them in `result_dir`. If `None`, results 
+        are returned to the Redis queue, which keeps them on the job.
+
+    result_compression : str or None, default=None
+        Compression of stored results; `'zlib'`, `'lz4'` (requires the `lz4` 
+        package), or `None`.
+
+    result_dir : str, default='flask_worker_results'
+        Directory for the `'file'` result backend.
+
+    result_store : flask_worker.RedisResultStore or None
+        Result store created from the `result_backend` setting; a 
+        `flask_worker.FileResultStore` for the `'file'` backend.
+
+    result_ttl : int or None, default=86400
+        Number of seconds for which stored results are kept.
+
+    script_src : str
+        URL of the loading page script. The URL contains a hash of the 
+        script, which is served with long-lived cache headers.
+
     socketio : flask_socketio.SocketIO or None, default=None
         Socket object through which workers will emit job progress messages. 
-        While this argument is not required on initialization, it must be set 
-        before the app is run.
+        Required if the `transport` is `'socketio'`. While this argument is 
+        not required on initialization, it must be set before the app is run. 
+        Its event handlers are registered when it is set, or when the manager 
+        is initialized with the application, whichever comes last.
+
+    socketio_channel : str, default='flask-socketio'
+        Channel of the Flask-SocketIO message queue.
+
+    socketio_namespace : str, default='/flask-worker'
+        Socket.IO namespace shared by all workers. Clients join a room for 
+        each worker they track, named by the worker's `model_id`, so one 
+        connection can follow any number of workers.
+
+    sse_keepalive : int, default=15
+        Number of seconds between keep-alive comments on a server-sent 
+        event stream.
+
+    sse_timeout : int, default=60
+        Number of seconds after which a server-sent event stream is closed. 
+        The browser reconnects automatically.
+
+    state_backend : str or None, default=None
+        Where workers' job state (`job_finished`, `job_in_progress`, and 
+        `job_id`) is kept. `'redis'` keeps it in a Redis hash per worker and 
+        writes it behind to the database; see `flush_worker_states`. If 
+        `None`, it is kept in the database's columns.
+
+    state_flush_interval : float or None, default=5
+        Number of seconds between flushes of workers' state to the 
+        database, performed by a daemon thread in each process which 
+        changes a worker's state. If `None`, state is flushed only when 
+        `flush_worker_states` is called.
+
+    state_store : flask_worker.RedisWorkerState or None
+        State store created from the `state_backend` setting.
+
+    state_ttl : int or None, default=86400
+        Number of seconds for which a worker's state is kept in Redis after 
+        it last changed.
+
+    status_max_age : int, default=1
+        Number of seconds for which clients and proxies may cache the 
+        response of the bulk job status endpoint while any job is pending. 
+        Responses in which every job is finished or failed are cached for 
+        an hour.
 
     template : str, default='worker/worker_loading.html'
         Name of the html template file for the loading page. Flask-Worker 
-        provides a default loading template.
+        provides a default loading template, which is rendered once and 
+        reused for every worker; see `loading_page`.
+
+    transport : str, default='socketio'
+        How loading pages hear job notifications. `'socketio'` uses the 
+        `socketio` attribute. `'sse'` streams server-sent events from the 
+        `_job_events` view function, which blocks on a Redis pub/sub channel 
+        for the worker; it does not require Flask-SocketIO.
     """
     def __init__(self, app=None, **kwargs):
         settings = default_settings.copy()
@@ -103,7 +456,8 @@ class Manager():
         worker blueprint template folder contains the worker script and 
         default html template. These can be found by flask.render_template.
 
-        The constructor also defines the _check_job_status view function.
+        The constructor also defines the _check_job_status and 
+        _check_jobs_status view functions.
         """
         if not hasattr(app, 'extensions'):
             app.extensions = {}
@@ -115,7 +469,11 @@ class Manager():
             template_folder='templates'
         )
         app.register_blueprint(bp)
-        self.connection = self.connection or app.redis
+        app.cli.add_command(worker_cli)
+        self.connection = self.connection or getattr(app, 'redis', None)
+        self._app_initialized = True
+        if self.socketio is not None:
+            self._init_socketio()
 
         @app.route('/_check_job_status')
         def _check_job_status():
@@ -130,22 +488,1065 @@ class Manager():
             notification, before the socket connects. Without checking the 
             job status on socket connection, the loading page would not hear 
             the 'job_finished' emission and continue running indefinitely.
+
+            While the job is queued, the response also includes its 
+            `position` in the queue and its `estimated_wait` in seconds.
             """
             job_id = request.args.get('job_id')
-            job = rq.job.Job.fetch(job_id, connection=self.connection)
-            return {'job_finished': job.is_finished}
+            status = self.job_statuses([job_id])[job_id]['status']
+            response = {'job_finished': status == 'finished'}
+            if status == 'queued':
+                response.update(self.queue_position(job_id))
+            return response
+
+        @app.route('/_check_jobs_status')
+        def _check_jobs_status():
+            """Check the status of many jobs
+
+            This view function expects one or more `job_id` URL parameters. 
+            It returns a JSON object mapping each job id to its status 
+            (`queued`, `started`, `finished`, `failed`, etc., or `null` if 
+            the job does not exist) and progress.
+
+            The response carries an ETag and Cache-Control header, so 
+            clients which reconnect at the same time can be answered by a 
+            cache or with a 304 response.
+            """
+            statuses = self.job_statuses(request.args.getlist('job_id'))
+            response = jsonify(statuses)
+            final = all(
+                s['status'] in FINAL_STATUSES for s in statuses.values()
+            )
+            response.cache_control.public = True
+            response.cache_control.max_age = (
+                3600 if final else self.status_max_age
+            )
+            response.add_etag()
+            return response.make_conditional(request)
+
+        @app.route('/_worker_metrics')
+        def _worker_metrics():
+            """Export metrics in the Prometheus text format
+
+            Includes the depths of the manager's queues when it uses the 
+            `'rq'` executor.
+            """
+            if self.metrics is None:
+                abort(404)
+            queue_depths = None
+            if isinstance(self.task_executor, RQExecutor):
+                queues = [self.get_queue(name) for name in self.queue_names]
+                with current_app.task_queue.connection.pipeline() as pipe:
+                    [pipe.llen(queue.key) for queue in queues]
+                    queue_depths = dict(
+                        zip([queue.name for queue in queues], pipe.execute())
+                    )
+            return Response(
+                self.metrics.prometheus(queue_depths), 
+                mimetype='text/plain; version=0.0.4'
+            )
+
+        @app.route('/_job_callback', methods=['POST'])
+        def _job_callback():
+            """Record that the client reached its callback
+
+            The loading page sends this beacon, with the job id as a URL 
+            parameter, just before it navigates to the worker's callback.
+            """
+            if self.metrics is not None:
+                self.metrics.record_callback(request.args.get('job_id'))
+            return '', 204
+
+        @app.route('/_job_events')
+        def _job_events():
+            """Stream job notifications as server-sent events
+
+            This view function expects the worker's `model_id` and `job_id` 
+            as URL parameters. It subscribes to the worker's Redis channel 
+            before checking the job status, so a 'job_finished' 
+            notification cannot be missed between the two.
+            """
+            model_id = request.args.get('model_id')
+            job_id = request.args.get('job_id')
+            return Response(
+                self._stream_events(model_id, job_id),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'
+                }
+            )
+
+        @app.route('/_worker_script/<version>.js')
+        def _worker_script(version):
+            """Serve the loading page script
+
+            The script's URL contains a hash of its contents, so clients may 
+            cache it indefinitely.
+            """
+            response = Response(
+                self._script[1], mimetype='application/javascript'
+            )
+            response.cache_control.public = True
+            response.cache_control.max_age = SCRIPT_MAX_AGE
+            response.cache_control.immutable = True
+            response.set_etag(self._script[0])
+            return response.make_conditional(request)
+
+    def _init_socketio(self):
+        """Register the socket event handlers
+
+        Clients emit a 'join' event with a list of worker `model_id`s. The 
+        handler adds the client to the room for each worker and acknowledges 
+        the event, after which the client checks the job status. If jobs 
+        may be abandoned, clients also emit periodic 'heartbeat' events.
+        """
+        from flask_socketio import join_room
+
+        if getattr(self, '_registered_socketio', None) is self.socketio:
+            return
+        self._registered_socketio = self.socketio
+
+        @self.socketio.on('join', namespace=self.socketio_namespace)
+        def join(model_ids):
+            [join_room(model_id) for model_id in model_ids]
+            self.touch_clients(model_ids)
+            return True
+
+        @self.socketio.on('heartbeat', namespace=self.socketio_namespace)
+        def heartbeat(model_ids):
+            self.touch_clients(model_ids)
+
+    @property
+    def socketio(self):
+        return self._socketio
+
+    @socketio.setter
+    def socketio(self, socketio):
+        # a socket set after the manager was initialized with the app still 
+        # needs its event handlers
+        self._socketio = socketio
+        if socketio is not None and getattr(self, '_app_initialized', False):
+            self._init_socketio()
+
+    def _stream_events(self, model_id, job_id):
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel(model_id))
+        keepalive = self.sse_keepalive
+        if self.abandon_after:
+            # the open stream is the client's heartbeat
+            keepalive = min(keepalive, self.abandon_after/3.)
+        try:
+            yield 'retry: 1000\n\n'
+            if self.job_statuses([job_id])[job_id]['status'] == 'finished':
+                yield format_event('job_finished')
+                return
+            deadline = time.time() + self.sse_timeout
+            while time.time() < deadline:
+                self.touch_clients([model_id])
+                message = pubsub.get_message(timeout=keepalive)
+                if message is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                message = json.loads(message['data'])
+                yield format_event(message['event'], message['data'])
+                if message['event'] in (
+                    'job_finished', 'job_cancelled', 'job_failed'
+                ):
+                    return
+        finally:
+            pubsub.close()
+
+    @property
+    def _script(self):
+        # version and contents of the loading page script, read once
+        if getattr(self, '_script_cache', None) is None:
+            with open(SCRIPT_PATH, 'rb') as f:
+                script = f.read()
+            version = hashlib.sha1(script).hexdigest()[:12]
+            self._script_cache = version, script
+        return self._script_cache
+
+    @property
+    def script_src(self):
+        """
+        Versioned URL of the loading page script.
+        """
+        return url_for('_worker_script', version=self._script[0])
+
+    def loading_page(self, worker):
+        """
+        Render a worker's loading page. The default template is rendered once 
+        into a shell, in which only the worker's `model_id`, `job_id`, 
+        `callback`, and `loading_img_src` are substituted for each worker. 
+        Custom templates are rendered with `flask.render_template`.
+
+        Parameters
+        ----------
+        worker : flask_worker.WorkerMixin
+
+        Returns
+        -------
+        loading_page : str (html)
+        """
+        self.touch_clients([worker.model_id])
+        if worker.template != default_settings['template']:
+            return render_template(worker.template, worker=worker)
+        if getattr(self, '_shells', None) is None:
+            self._shells = {}
+        # the urls in the shell depend on the application root
+        shell = self._shells.get(request.script_root)
+        if shell is None:
+            shell = render_template(worker.template, worker=ShellWorker(self))
+            self._shells[request.script_root] = shell
+        for field in ShellWorker.fields:
+            shell = shell.replace(
+                ShellWorker.placeholder(field), 
+                escape(str(getattr(worker, field)))
+            )
+        return shell
+
+    def touch_clients(self, model_ids):
+        """
+        Record that a client is on the loading page of each worker. The 
+        record expires after `abandon_after` seconds. Does nothing if 
+        `abandon_after` is `None`.
+
+        Parameters
+        ----------
+        model_ids : list of str
+            Workers' `model_id`s.
+        """
+        if not self.abandon_after or not model_ids:
+            return
+        ttl = int(max(self.abandon_after, 1))
+        pipe = self.connection.pipeline(transaction=False)
+        [
+            pipe.set(self._client_key(model_id), 1, ex=ttl) 
+            for model_id in model_ids
+        ]
+        pipe.execute()
+
+    def _client_key(self, model_id):
+        return 'flask_worker:client:' + model_id
+
+    def cancel_job(self, job_id):
+        """
+        Cancel a job. If the job is queued, it is skipped when it is 
+        dequeued. If it is running, it stops at its next 
+        `flask_worker.check_cancelled` call.
+
+        Parameters
+        ----------
+        job_id : str
+        """
+        self.connection.set(
+            self._cancel_key(job_id), 1, ex=self.result_ttl or None
+        )
+
+    def _cancel_key(self, job_id):
+        return 'flask_worker:cancel:' + job_id
+
+    def job_cancelled(self, job_id, model_id):
+        """
+        Parameters
+        ----------
+        job_id : str
+
+        model_id : str
+            `model_id` of the job's worker.
+
+        Returns
+        -------
+        cancelled : bool
+            Indicates that the job was cancelled, or that its worker was 
+            abandoned.
+        """
+        if self.connection is None:
+            return False
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.exists(self._cancel_key(job_id))
+        if self.abandon_after:
+            pipe.exists(self._client_key(model_id))
+        cancelled, *attached = pipe.execute()
+        return bool(cancelled) or attached == [0]
+
+    def channel(self, model_id):
+        """
+        Parameters
+        ----------
+        model_id : str
+            Worker's `model_id`.
+
+        Returns
+        -------
+        channel : str
+            Name of the Redis pub/sub channel for the worker's notifications.
+        """
+        return channel(model_id)
+
+    def notify(self, model_id, event, data=None):
+        """
+        Send a job notification to the clients of a worker, using the 
+        manager's `transport`.
+
+        Parameters
+        ----------
+        model_id : str
+            Worker's `model_id`.
+
+        event : str
+            Name of the event, e.g. `'job_started'` or `'job_finished'`.
+
+        data : dict or None, default=None
+            JSON-serializable data sent with the event.
+        """
+        if self.emitter is not None:
+            self.emitter.emit(model_id, event, data)
+        elif self.transport == 'sse':
+            message = json.dumps(dict(event=event, data=data))
+            self.connection.publish(self.channel(model_id), message)
+        else:
+            self.socketio.emit(
+                event, dict(model_id=model_id, data=data),
+                namespace=self.socketio_namespace, room=model_id
+            )
+
+    def job_statuses(self, job_ids):
+        """
+        Get the status and progress of many jobs. With the `'rq'` executor, 
+        this takes one pipelined Redis call which reads only the job's 
+        status and meta fields. The progress of map jobs is the fraction of 
+        completed chunks.
+
+        Parameters
+        ----------
+        job_ids : list of str
+            Job identifiers.
+
+        Returns
+        -------
+        statuses : dict
+            Maps job ids to dictionaries with `status` and `progress` keys. 
+            The status is `None` if the job does not exist.
+        """
+        map_ids = [job_id for job_id in job_ids if is_map_id(job_id)]
+        statuses = self.task_executor.statuses(
+            [job_id for job_id in job_ids if not is_map_id(job_id)]
+        )
+        if map_ids:
+            statuses.update(MapState.statuses(self.connection, map_ids))
+        return statuses
+
+    def job_result(self, job_id):
+        """
+        Load the result of a job from the result store, the map job state, or 
+        the executor.
+
+        Parameters
+        ----------
+        job_id : str
+
+        Returns
+        -------
+        result :
+        """
+        if self.result_store is not None:
+            return self.result_store.get(job_id)
+        if is_map_id(job_id):
+            return MapState(self.connection, job_id).result()
+        return self.task_executor.result(job_id)
+
+    def enqueue_job(self, worker, f, job_kwargs, queue=None):
+        """
+        Enqueue a worker's job and set the worker's job state.
+
+        Parameters
+        ----------
+        worker : flask_worker.WorkerMixin
+            Worker whose job is enqueued.
+
+        f : str
+            Import path of the task, e.g. `'flask_worker.tasks.execute_func'`.
+
+        job_kwargs : dict
+            Keyword arguments passed to the task.
+
+        queue : str or None, default=None
+            Name of the queue on which the job is enqueued. If `None`, it is 
+            enqueued on the app's task queue. Local executors ignore it.
+
+        Returns
+        -------
+        worker : flask_worker.WorkerMixin
+            The worker. Its `job_id` is the id of the enqueued job, or of the 
+            existing job to which it was attached if `deduplicate` is `True`. 
+            If `memoize` is `True` and the result was cached, the worker is 
+            already finished.
+
+        Raises
+        ------
+        flask_worker.Overloaded
+            If the job was not admitted because an in-flight limit was hit. 
+            See `queue_limits` and `key_limit`.
+        """
+        enqueue_started = time.perf_counter()
+        if self.memoize and f == 'flask_worker.tasks.execute_func':
+            if self.result_store is None:
+                raise ValueError('memoize requires a result_backend')
+            memo_key = self.memo.key(
+                job_kwargs['func'], job_kwargs['args'], job_kwargs['kwargs']
+            )
+            data = self.memo.get(memo_key)
+            if data is not None:
+                # finish the worker without enqueuing a job
+                worker.job_id = 'flask-worker-memo-' + uuid4().hex
+                self.result_store.set_raw(worker.job_id, data)
+                worker.job_finished, worker.job_in_progress = True, False
+                return worker
+            job_kwargs = dict(job_kwargs, memo_key=memo_key)
+        job_id, claimed = self._claim_job_id(worker, f, job_kwargs)
+        # local executors have no queues
+        rq_executor = isinstance(self.task_executor, RQExecutor)
+        queue = self.get_queue(queue) if rq_executor else None
+        if claimed:
+            try:
+                queue = self._admit(worker, job_id, queue)
+            except Overloaded:
+                self.release_job(job_id)
+                raise
+        worker.job_finished, worker.job_in_progress = False, True
+        worker.job_id = job_id
+        # the requesting client is on the loading page
+        self.touch_clients([worker.model_id])
+        # commit before enqueuing, so the job never loads a stale state
+        self.db.session.commit()
+        if claimed:
+            f, job_kwargs = self._detach_job(worker, f, job_kwargs)
+            try:
+                self.task_executor.enqueue(
+                    f, job_kwargs, job_id=job_id, queue=queue
+                )
+            except Exception:
+                # the job was never enqueued; leave the worker idle
+                worker.reset()
+                self.release_job(job_id)
+                self.db.session.commit()
+                raise
+        if self.metrics is not None:
+            name = job_name(
+                job_kwargs.get('func'), job_kwargs.get('model_cls'), 
+                job_kwargs.get('method_name')
+            )
+            self.metrics.observe(
+                'enqueue', time.perf_counter()-enqueue_started
+            )
+            self.metrics.count('enqueued', name)
+        return worker
+
+    def _admit(self, worker, job_id, queue):
+        # admit a job to its queue (None with local executors), or shed it 
+        # to the overload queue; returns the queue on which to enqueue it
+        if self.admission is None:
+            return queue
+        key = None
+        if self.admission_key is not None:
+            key = self.admission_key(worker)
+        if self.admission.admit(job_id, queue and queue.name, key):
+            return queue
+        if queue is not None and self.overload_queue is not None:
+            if self.admission.admit(job_id, self.overload_queue, key):
+                return self.get_queue(self.overload_queue)
+        raise Overloaded(job_id)
+
+    def overloaded(self, worker):
+        """
+        Respond to a client whose worker's job was not admitted.
+
+        Parameters
+        ----------
+        worker : flask_worker.WorkerMixin
+
+        Returns
+        -------
+        response : flask.Response
+            See `overload_response`.
+        """
+        if self.overload_response is not None:
+            return self.overload_response(worker)
+        retry_after = OVERLOAD_RETRY_AFTER
+        if isinstance(self.task_executor, RQExecutor):
+            queue = self.get_queue(worker.job_queue)
+            wait = self.estimated_wait(queue, queue.count)
+            if wait is not None:
+                retry_after = math.ceil(wait)
+        return Response(
+            'The server is busy. Please try again shortly.', 503, 
+            headers={'Retry-After': str(retry_after)}, mimetype='text/plain'
+        )
+
+    def queue_position(self, job_id):
+        """
+        Parameters
+        ----------
+        job_id : str
+
+        Returns
+        -------
+        position : dict
+            The job's `position` in its queue (0 is next), and its 
+            `estimated_wait` in seconds until it starts. Values are `None` 
+            if they are unknown, e.g. if the job is not queued. The wait is 
+            estimated with `collect_metrics` only.
+        """
+        position = dict(position=None, estimated_wait=None)
+        if not isinstance(self.task_executor, RQExecutor):
+            return position
+        connection = current_app.task_queue.connection
+        origin = connection.hget(Job.key_for(job_id), 'origin')
+        if origin is None:
+            return position
+        queue = self.get_queue(origin.decode())
+        try:
+            index = connection.execute_command('LPOS', queue.key, job_id)
+        except ResponseError:
+            # Redis < 6.0.6
+            job_ids = queue.get_job_ids()
+            index = job_ids.index(job_id) if job_id in job_ids else None
+        if index is not None:
+            position['position'] = index
+            position['estimated_wait'] = self.estimated_wait(queue, index)
+        return position
+
+    def estimated_wait(self, queue, position):
+        """
+        Estimate the wait until the job at a position in a queue starts, 
+        from the mean execution time of jobs and the number of `rq` workers 
+        listening on the queue.
+
+        Parameters
+        ----------
+        queue : rq.Queue
+
+        position : int
+
+        Returns
+        -------
+        seconds : float or None
+            `None` if the manager does not `collect_metrics`, if no job was 
+            timed yet, or if no worker listens on the queue.
+        """
+        if self.metrics is None:
+            return None
+        mean = self.metrics.mean('execute')
+        workers = Worker.count(queue=queue)
+        if mean is None or not workers:
+            return None
+        return (position+1) * mean / workers
+
+    def get_queue(self, name=None):
+        """
+        Get a queue from the manager's registry. Queues are created once and 
+        share the connection pool of the app's task queue.
+
+        Parameters
+        ----------
+        name : str or None, default=None
+            Name of the queue. If `None`, the app's task queue is returned.
+
+        Returns
+        -------
+        queue : rq.Queue
+        """
+        task_queue = current_app.task_queue
+        if name is None or name == task_queue.name:
+            return task_queue
+        if getattr(self, '_queues', None) is None:
+            self._queues = {}
+        if name not in self._queues:
+            self._queues[name] = Queue(name, connection=task_queue.connection)
+        return self._queues[name]
+
+    @property
+    def queue_names(self):
+        weights = self.queue_weights or {}
+        names = sorted(weights, key=weights.get, reverse=True)
+        task_queue = current_app.task_queue.name
+        return names if task_queue in names else [task_queue] + names
+
+    def _detach_job(self, worker, f, job_kwargs):
+        # run function jobs without the application if detached_jobs is set; 
+        # local executors run jobs on the loaded application anyway
+        if (
+            not self.detached_jobs or f != 'flask_worker.tasks.execute_func'
+            or not isinstance(self.task_executor, RQExecutor)
+        ):
+            return f, job_kwargs
+        if not self.message_queue or self.state_backend != 'redis':
+            raise ValueError(
+                'detached_jobs requires a message_queue and the redis '
+                'state_backend'
+            )
+        if connection_url(self.connection) is None:
+            raise ValueError(
+                'detached_jobs requires a connection to a Redis server '
+                'reachable by URL'
+            )
+        return 'flask_worker.tasks.execute_detached_func', dict(
+            settings=self.job_settings, model_id=worker.model_id, 
+            func=job_kwargs['func'], args=job_kwargs['args'], 
+            kwargs=job_kwargs['kwargs'], memo_key=job_kwargs.get('memo_key')
+        )
+
+    @property
+    def job_settings(self):
+        """
+        Settings passed with detached jobs, from which the job builds its 
+        manager. `'connection_url'` is the Redis URL of the `connection`.
+        """
+        settings = {key: getattr(self, key) for key in DETACHED_SETTINGS}
+        settings['connection_url'] = connection_url(self.connection)
+        return settings
+
+    def _claim_job_id(self, worker, f, job_kwargs):
+        # return the job id and whether this request should enqueue the job
+        if not self.deduplicate:
+            return str(uuid4()), True
+        call_kwargs = job_kwargs.get('kwargs', {})
+        job_id = 'flask-worker-' + call_hash(
+            worker.model_id, f, 
+            *sorted((k, v) for k, v in job_kwargs.items() if k != 'kwargs'), 
+            **call_kwargs
+        )
+        claimed = self.connection.set(
+            self._claim_key(job_id), 1, nx=True, ex=self.deduplicate_ttl
+        )
+        return job_id, bool(claimed)
+
+    def release_job(self, job_id):
+        """
+        Release the deduplication claim on a job, so that an identical job 
+        may be enqueued again. Its cancellation flag is cleared too, since 
+        the identical job has the same id. The job's in-flight slots are 
+        released as well.
+
+        Parameters
+        ----------
+        job_id : str
+        """
+        if self.deduplicate:
+            self.connection.delete(
+                self._claim_key(job_id), self._cancel_key(job_id)
+            )
+        if self.admission is not None:
+            self.admission.release(job_id)
+
+    def _claim_key(self, job_id):
+        return 'flask_worker:claim:' + job_id
+
+    def enqueue_map(
+        self, worker, func, iterable, chunk_size, reduce=None, queue=None
+    ):
+        """
+        Enqueue a map job for a worker and set the worker's job state. See 
+        `WorkerMixin.enqueue_map`. The chunks are enqueued on the `queue` 
+        named as in `enqueue_job`.
+
+        Returns
+        -------
+        worker : flask_worker.WorkerMixin
+        """
+        f = 'flask_worker.tasks.execute_chunk'
+        map_id = new_map_id()
+        job_kwargs = [
+            dict(
+                app_import=self.app_import,
+                worker_cls=type(worker), 
+                worker_id=inspect(worker).identity[0],
+                map_id=map_id, index=index, func=func, chunk=chunk, 
+                reduce=reduce
+            )
+            for index, chunk in enumerate(chunks(iterable, chunk_size))
+        ]
+        state = MapState(self.connection, map_id, self.result_ttl)
+        state.create(len(job_kwargs))
+        worker.job_id = map_id
+        if not job_kwargs:
+            # nothing to map
+            result = [] if reduce is None else reduce([])
+            state.finish(result)
+            if self.result_store is not None:
+                self.result_store.set(map_id, result)
+            worker.job_finished, worker.job_in_progress = True, False
+            return worker
+        worker.job_finished, worker.job_in_progress = False, True
+        self.touch_clients([worker.model_id])
+        # commit before enqueuing, so the chunks never load a stale state
+        self.db.session.commit()
+        if isinstance(self.task_executor, RQExecutor):
+            # enqueue all chunks in one round trip
+            queue = self.get_queue(queue)
+            with queue.connection.pipeline() as pipe:
+                queue.enqueue_many(
+                    [queue.prepare_data(f, kwargs=kw) for kw in job_kwargs], 
+                    pipeline=pipe
+                )
+                pipe.execute()
+        else:
+            [self.task_executor.enqueue(f, kw) for kw in job_kwargs]
+        return worker
+
+    def enqueue_chain(self, worker, steps, queue=None):
+        """
+        Enqueue a job chain for a worker and set the worker's job state. See 
+        `WorkerMixin.enqueue_chain`. Every step is enqueued on the `queue` 
+        named as in `enqueue_job`. Requires the `'rq'` executor.
+
+        Returns
+        -------
+        worker : flask_worker.WorkerMixin
+        """
+        if not isinstance(self.task_executor, RQExecutor):
+            raise ValueError('Job chains require the rq executor')
+        afters = resolve_steps(steps)
+        job_ids = chain_job_ids(new_chain_id(), len(steps))
+        worker.job_finished, worker.job_in_progress = False, True
+        # the last step finishes the worker
+        worker.job_id = job_ids[-1]
+        self.touch_clients([worker.model_id])
+        # commit before enqueuing, so the steps never load a stale state
+        self.db.session.commit()
+        queue = self.get_queue(queue)
+        worker_id = inspect(worker).identity[0]
+        # enqueue the whole chain in one transaction, so no step runs, or 
+        # fails, before the steps which run after it are deferred
+        with queue.connection.pipeline() as pipe:
+            for index, (step, after) in enumerate(zip(steps, afters)):
+                job = queue.create_job(
+                    'flask_worker.tasks.execute_step', 
+                    kwargs=dict(
+                        app_import=self.app_import, worker_cls=type(worker), 
+                        worker_id=worker_id, chain=job_ids, index=index, 
+                        after=after, func=step.func, args=step.args, 
+                        kwargs=step.kwargs
+                    ), 
+                    job_id=job_ids[index], 
+                    depends_on=[job_ids[i] for i in after] or None, 
+                    status=JobStatus.DEFERRED if after else JobStatus.QUEUED
+                )
+                if after:
+                    # rq enqueues the step once the steps it runs after 
+                    # have finished
+                    job.register_dependency(pipeline=pipe)
+                    job.save(pipeline=pipe)
+                else:
+                    queue.enqueue_job(job, pipeline=pipe)
+            pipe.execute()
+        return worker
+
+    def enqueue_many(self, jobs):
+        """
+        Enqueue functions for many workers at once. All new workers are 
+        committed together, the workers' job states are set in one commit, 
+        and then every job is pushed through a single Redis pipeline.
+
+        Workers which already have a job in progress are skipped. Jobs are 
+        enqueued on their worker's `job_queue`. With the `rq` executor, jobs 
+        are not deduplicated, memoized, or subject to admission control; 
+        see `deduplicate`, `memoize`, and `queue_limits`.
+
+        Parameters
+        ----------
+        jobs : list of (worker, func, args, kwargs) tuples
+            Each worker will execute `func(*args, **kwargs)`, as in 
+            `WorkerMixin.enqueue_function`.
+
+        Returns
+        -------
+        workers : list of flask_worker.WorkerMixin
+            The workers, in the order in which they were passed.
+
+        Examples
+        --------
+        ```python
+        manager.enqueue_many([
+            (worker, complex_task, (5,), {}) for worker in workers
+        ])
+        ```
+        """
+        session = self.db.session
+        workers = [job[0] for job in jobs]
+        if any(inspect(worker).identity is None for worker in workers):
+            # ensure the workers have ids
+            session.add_all(workers)
+            session.commit()
+        jobs = [job for job in jobs if not job[0].job_in_progress]
+        if not jobs:
+            return workers
+        if not isinstance(self.task_executor, RQExecutor):
+            for worker, func, args, kwargs in jobs:
+                f, job_kwargs = worker._function_job(func, args, kwargs)
+                self.enqueue_job(worker, f, job_kwargs)
+            session.commit()
+            return workers
+        enqueue_started = time.perf_counter()
+        self.touch_clients([job[0].model_id for job in jobs])
+        # group the jobs by queue
+        job_datas, names = {}, []
+        for worker, func, args, kwargs in jobs:
+            queue = self.get_queue(worker.job_queue)
+            f, job_kwargs = worker._function_job(func, args, kwargs)
+            names.append(job_name(job_kwargs['func']))
+            f, job_kwargs = self._detach_job(worker, f, job_kwargs)
+            worker.job_finished, worker.job_in_progress = False, True
+            worker.job_id = str(uuid4())
+            job_datas.setdefault(queue, []).append(
+                queue.prepare_data(f, kwargs=job_kwargs, job_id=worker.job_id)
+            )
+        # commit before enqueuing, so no job ever loads a stale state
+        session.commit()
+        try:
+            with current_app.task_queue.connection.pipeline() as pipe:
+                for queue, datas in job_datas.items():
+                    queue.enqueue_many(datas, pipeline=pipe)
+                pipe.execute()
+        except Exception:
+            # no job was enqueued; leave the workers idle
+            [job[0].reset() for job in jobs]
+            session.commit()
+            raise
+        if self.metrics is not None:
+            self.metrics.observe(
+                'enqueue', time.perf_counter()-enqueue_started
+            )
+            [self.metrics.count('enqueued', name) for name in names]
+        return workers
+
+    def reap_stuck_jobs(self, requeue=True):
+        """
+        Find workers whose job is stuck in progress (because it failed, went 
+        missing, or stopped sending heartbeats) and recover them in bulk. 
+        Stuck jobs are requeued if the executor still has them; otherwise 
+        the worker is reset and its loading page reloads. See 
+        `flask_worker.recovery`.
+
+        Call this periodically, e.g. with the `flask worker reap --interval 
+        60` command. Missing and stale jobs are only recovered once they 
+        have been seen on two consecutive calls.
+
+        Parameters
+        ----------
+        requeue : bool, default=True
+            Indicates that stuck jobs are requeued if possible. If `False`, 
+            stuck workers are always reset.
+
+        Returns
+        -------
+        counts : dict
+            Numbers of `stuck` workers, and of workers whose job was 
+            `requeued`, which were `reset`, and which failed after 
+            `exhausted` retries.
+        """
+        workers = [
+            worker for cls in worker_classes().values()
+            for worker in cls.query.filter(cls.job_in_progress == True)
+            # the state in the database may be behind the state in Redis
+            if worker.job_in_progress and worker.job_id
+        ]
+        counts = Reaper(self).reap(workers, requeue)
+        if self.metrics is not None:
+            self.metrics.record_reap(counts)
+        return counts
+
+    @property
+    def task_executor(self):
+        if getattr(self, '_task_executor', None) is None:
+            if self.executor == 'rq':
+                self._task_executor = RQExecutor(self.connection)
+            elif self.executor == 'thread':
+                self._task_executor = ThreadExecutor(self.executor_workers)
+            elif self.executor == 'asyncio':
+                self._task_executor = AsyncioExecutor(self.executor_workers)
+            elif isinstance(self.executor, str):
+                raise ValueError('Unknown executor {}'.format(self.executor))
+            else:
+                self._task_executor = self.executor
+        return self._task_executor
+
+    @property
+    def admission(self):
+        if (
+            getattr(self, '_admission', None) is None 
+            and (self.queue_limits or self.key_limit is not None)
+        ):
+            self._admission = Admission(
+                self.connection, self.queue_limits, self.key_limit, 
+                self.admission_ttl
+            )
+        return getattr(self, '_admission', None)
+
+    @property
+    def emitter(self):
+        if getattr(self, '_emitter', None) is None and self.message_queue:
+            self._emitter = Emitter(
+                self.message_queue, self.transport, self.socketio_namespace, 
+                self.socketio_channel
+            )
+        return getattr(self, '_emitter', None)
+
+    @property
+    def metrics(self):
+        if getattr(self, '_metrics', None) is None and self.collect_metrics:
+            self._metrics = Metrics(
+                self.connection, self.metrics_buckets or DEFAULT_BUCKETS
+            )
+        return getattr(self, '_metrics', None)
+
+    def on_job_timings(self, callback):
+        """
+        Register a callback which is called with `(job_id, name, timings)` 
+        whenever a job finishes. `name` is the job's function or method, and 
+        `timings` maps its phases to durations in seconds. Callbacks run in 
+        the process which executed the job. Can be used as a decorator.
+
+        Parameters
+        ----------
+        callback : callable
+
+        Returns
+        -------
+        callback : callable
+        """
+        self.metrics.callbacks.append(callback)
+        return callback
+
+    @property
+    def memo(self):
+        if getattr(self, '_memo', None) is None and self.memoize:
+            self._memo = Memo(
+                self.connection, self.memoize_ttl, self.memoize_max_entries,
+                self.result_compression
+            )
+        return getattr(self, '_memo', None)
+
+    def memo_stats(self):
+        """
+        Returns
+        -------
+        stats : dict
+            Numbers of memoization cache `hits`, `misses`, and `evictions`.
+        """
+        return self.memo.stats()
+
+    @property
+    def result_store(self):
+        if getattr(self, '_result_store', None) is None:
+            if self.result_backend == 'redis':
+                self._result_store = RedisResultStore(
+                    self.connection, self.result_ttl, self.result_compression
+                )
+            elif self.result_backend == 'file':
+                self._result_store = FileResultStore(
+                    self.result_dir, self.result_ttl, self.result_compression
+                )
+            elif self.result_backend is not None:
+                raise ValueError(
+                    'Unknown result backend {}'.format(self.result_backend)
+                )
+            else:
+                return None
+        return self._result_store
+
+    @property
+    def state_store(self):
+        if getattr(self, '_state_store', None) is None:
+            if self.state_backend == 'redis':
+                self._state_store = RedisWorkerState(
+                    self.connection, self.state_ttl
+                )
+                if self.state_flush_interval:
+                    # write behind from the process which changes the state
+                    self._state_flusher = StateFlusher(
+                        current_app._get_current_object(), 
+                        self.state_flush_interval
+                    )
+                    self._state_flusher.start()
+            elif self.state_backend is not None:
+                raise ValueError(
+                    'Unknown state backend {}'.format(self.state_backend)
+                )
+            else:
+                return None
+        return self._state_store
+
+    def flush_worker_states(self, batch_size=1000):
+        """
+        Write the job state of workers whose state changed in Redis to their 
+        database columns. Each batch of workers is written in one commit.
+
+        Parameters
+        ----------
+        batch_size : int, default=1000
+            Maximum number of workers written per commit.
+
+        Returns
+        -------
+        n_flushed : int
+            Number of workers whose state was flushed.
+        """
+        store = self.state_store
+        if store is None:
+            return 0
+        n_flushed = 0
+        while True:
+            model_ids = store.pop_dirty(batch_size)
+            if not model_ids:
+                return n_flushed
+            try:
+                self._flush_states(store.get_many(model_ids))
+            except Exception:
+                self.db.session.rollback()
+                store.mark_dirty(model_ids)
+                raise
+            n_flushed += len(model_ids)
+
+    def _flush_states(self, states):
+        # group the workers by class, then update each class's rows
+        ids, classes = {}, worker_classes()
+        # match the longest table name first
+        tablenames = sorted(classes, key=len, reverse=True)
+        for model_id in states:
+            for tablename in tablenames:
+                cls = classes[tablename]
+                if model_id.startswith(tablename+'-'):
+                    key = inspect(cls).primary_key[0]
+                    ids.setdefault(cls, []).append(
+                        key.type.python_type(model_id[len(tablename)+1:])
+                    )
+                    break
+        for cls, cls_ids in ids.items():
+            key = inspect(cls).primary_key[0]
+            for worker in cls.query.filter(key.in_(cls_ids)):
+                for field, value in states[worker.model_id].items():
+                    setattr(worker, '_'+field, value)
+        self.db.session.commit()
 
     @property
     def loading_img_src(self):
-        if hasattr(self, '_loading_img_src') and self._loading_img_src:
+        if getattr(self, '_loading_img_src', None):
             return self._loading_img_src
-        try:
+        if getattr(self, '_default_loading_img_src', None) is None:
             bp = self.loading_img_blueprint
             static = bp + '.static' if bp else 'static'
-            return url_for(static, filename=self.loading_img_filename)
-        except:
-            pass
+            try:
+                self._default_loading_img_src = url_for(
+                    static, filename=self.loading_img_filename
+                )
+            except (BuildError, RuntimeError):
+                # no static endpoint, or no application context
+                return None
+        return self._default_loading_img_src
 
     @loading_img_src.setter
     def loading_img_src(self, val):
-        self._loading_img_src = val
\ No newline at end of file
+        self._loading_img_src = val
+        self._default_loading_img_src = None
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""# Admission control
+
+Limits on the number of in-flight jobs, i.e. jobs which were enqueued and
+have not yet finished, failed, or been cancelled. Limits apply per queue
+(the manager's `queue_limits`) and per admission key, e.g. per user (the
+manager's `key_limit` and `admission_key`).
+
+Each limit keeps a sorted set of its in-flight job ids in Redis, scored by
+the time the job was admitted. A job is admitted by adding it to its sets
+and counting them in one transaction. If a set holds more jobs than its
+limit, the job is removed again and rejected, so a limit is never exceeded.
+Jobs which are never released, e.g. because their `rq` worker died, expire
+from the sets after `ttl` seconds.
+
+Admission applies to jobs enqueued with `WorkerMixin.enqueue_method` and
+`WorkerMixin.enqueue_function`. Map jobs, job chains, and
+`Manager.enqueue_many` are not limited.
+"""
+
+import time
+
+
+class Overloaded(Exception):
+    """
+    Raised when a job is not admitted because an in-flight limit was hit.
+    """
+    pass
+
+
+class Admission():
+    """
+    In-flight job limits kept in Redis.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection.
+
+    queue_limits : dict or None, default=None
+        Maps queue names to their maximum number of in-flight jobs.
+
+    key_limit : int or None, default=None
+        Maximum number of in-flight jobs per admission key.
+
+    ttl : int, default=3600
+        Number of seconds after which an in-flight job which was never
+        released stops counting towards its limits.
+
+    prefix : str, default='flask_worker:admission:'
+        Prefix of the Redis keys.
+    """
+    def __init__(
+            self, connection, queue_limits=None, key_limit=None, ttl=3600,
+            prefix='flask_worker:admission:'
+        ):
+        self.connection = connection
+        self.queue_limits = queue_limits or {}
+        self.key_limit = key_limit
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _slots(self, queue, key):
+        # (sorted set, limit) pairs which apply to a job
+        slots = []
+        queue_limit = self.queue_limits.get(queue)
+        if queue_limit is not None:
+            slots.append((self.prefix+'queue:'+queue, queue_limit))
+        if key is not None and self.key_limit is not None:
+            slots.append((self.prefix+'key:'+str(key), self.key_limit))
+        return slots
+
+    def _job_key(self, job_id):
+        # set of the sorted sets in which a job holds a slot
+        return self.prefix + 'job:' + job_id
+
+    def admit(self, job_id, queue=None, key=None):
+        """
+        Admit a job if none of its limits is hit.
+
+        Parameters
+        ----------
+        job_id : str
+
+        queue : str or None, default=None
+            Name of the queue on which the job will be enqueued.
+
+        key : str or None, default=None
+            Admission key, e.g. the id of the user who enqueued the job.
+
+        Returns
+        -------
+        admitted : bool
+        """
+        slots = self._slots(queue, key)
+        if not slots:
+            return True
+        now = time.time()
+        with self.connection.pipeline() as pipe:
+            for slot, _ in slots:
+                pipe.zremrangebyscore(slot, '-inf', now-self.ttl)
+                pipe.zadd(slot, {job_id: now})
+                pipe.zcard(slot)
+                pipe.expire(slot, self.ttl)
+            pipe.sadd(self._job_key(job_id), *[slot for slot, _ in slots])
+            pipe.expire(self._job_key(job_id), self.ttl)
+            counts = pipe.execute()[2:4*len(slots):4]
+        if all(count <= limit for count, (_, limit) in zip(counts, slots)):
+            return True
+        self.release(job_id)
+        return False
+
+    def release(self, job_id):
+        """
+        Release the slots held by a job.
+
+        Parameters
+        ----------
+        job_id : str
+        """
+        job_key = self._job_key(job_id)
+        slots = self.connection.smembers(job_key)
+        with self.connection.pipeline() as pipe:
+            [pipe.zrem(slot, job_id) for slot in slots]
+            pipe.delete(job_key)
+            pipe.execute()
+
+    def in_flight(self, queue=None, key=None):
+        """
+        Parameters
+        ----------
+        queue : str or None, default=None
+
+        key : str or None, default=None
+
+        Returns
+        -------
+        count : int
+            Number of in-flight jobs on the queue, or for the key if no
+            queue is given.
+        """
+        slot = (
+            self.prefix+'queue:'+queue if queue is not None
+            else self.prefix+'key:'+str(key)
+        )
+        return self.connection.zcount(slot, time.time()-self.ttl, '+inf')
@@ -0,0 +1,222 @@
+"""# Job chains
+
+A job chain runs a series, or a directed acyclic graph, of steps for one
+worker entirely on the server. Each step is a separate `rq` job which
+depends (through `depends_on`) on the jobs of the steps it runs after, so
+`rq` enqueues it once they have finished. A step's result is stored in
+Redis and passed to the steps which run after it. Only the last step
+finishes the worker, so its client sees a single `job_finished`.
+
+If a step fails or is cancelled, the chain's deferred jobs are deleted.
+The worker's job (the last step) is then missing, so `Manager.reap_stuck_jobs`
+resets the worker and its loading page enqueues the chain again. The reaper
+also resets a worker whose last step is still deferred while none of the
+steps before it is queued or running, e.g. because the `rq` worker running a
+step died before it could delete the deferred jobs.
+"""
+
+from flask_worker.results import dumps, loads
+
+from rq.job import Job
+from uuid import uuid4
+
+CHAIN_ID_PREFIX = 'flask-worker-chain-'
+
+
+def new_chain_id():
+    return CHAIN_ID_PREFIX + uuid4().hex
+
+def is_chain_id(job_id):
+    return job_id is not None and job_id.startswith(CHAIN_ID_PREFIX)
+
+def chain_job_ids(chain_id, n_steps):
+    """
+    Returns
+    -------
+    job_ids : list of str
+        Ids of the jobs of a chain's steps. The last is the worker's job.
+    """
+    return ['{}-{}'.format(chain_id, index) for index in range(n_steps)]
+
+def chain_of(job_id):
+    """
+    Parameters
+    ----------
+    job_id : str
+        Id of the job of a chain's last step, i.e. the worker's job.
+
+    Returns
+    -------
+    job_ids : list of str
+        Ids of the jobs of the chain's steps.
+    """
+    chain_id, _, index = job_id.rpartition('-')
+    return chain_job_ids(chain_id, int(index)+1)
+
+def resolve_steps(steps):
+    """
+    Resolve the steps which each step runs after. Every step must run 
+    before the last step, directly or through the steps in between, since 
+    the last step finishes the worker.
+
+    Parameters
+    ----------
+    steps : list of flask_worker.Step
+
+    Returns
+    -------
+    after : list of tuple of int
+        Indices of the steps after which each step runs.
+
+    Raises
+    ------
+    ValueError
+        If there are no steps, a step runs after itself or a later step, or 
+        a step does not run before the last step.
+    """
+    if not steps:
+        raise ValueError('A job chain requires at least one step')
+    resolved = []
+    for index, step in enumerate(steps):
+        after = step.after
+        if after is None:
+            after = () if index == 0 else (index-1,)
+        after = tuple(after)
+        if any(not 0 <= i < index for i in after):
+            raise ValueError(
+                'Step {} must run after earlier steps only'.format(index)
+            )
+        resolved.append(after)
+    # the ancestors of the last step
+    ancestors, stack = set(), list(resolved[-1])
+    while stack:
+        index = stack.pop()
+        if index not in ancestors:
+            ancestors.add(index)
+            stack.extend(resolved[index])
+    orphans = set(range(len(steps)-1)) - ancestors
+    if orphans:
+        raise ValueError(
+            'Steps {} must run before the last step'.format(sorted(orphans))
+        )
+    return resolved
+
+
+class Step():
+    """
+    Step of a job chain. The step calls `func`, passing the results of the
+    steps it runs after, followed by `args` and `kwargs`.
+
+    Parameters
+    ----------
+    func : callable
+        Function executed by the step. As with
+        `WorkerMixin.enqueue_function`, the `rq` worker must be able to
+        import it.
+
+    \*args, \*\*kwargs :
+        Arguments and keyword arguments passed to `func`.
+
+    after : list of int or None, default=None
+        Indices of the steps after which this step runs. Their results are
+        the first arguments passed to `func`, in this order. If `None`, the
+        step runs after the previous step, or first if it is the first step.
+
+    Examples
+    --------
+    ```python
+    from flask_worker import Step
+
+    worker.enqueue_chain([
+        Step(download, url),
+        Step(parse),
+        Step(thumbnails, after=[0]),
+        Step(publish, after=[1, 2])
+    ])
+    ```
+    """
+    def __init__(self, func, *args, after=None, **kwargs):
+        self.func, self.args, self.kwargs = func, args, kwargs
+        self.after = after
+
+    def __repr__(self):
+        return '<Step {}>'.format(getattr(self.func, '__name__', self.func))
+
+
+class ChainState():
+    """
+    Results of a job chain's steps in Redis.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection.
+
+    job_ids : list of str
+        Ids of the jobs of the chain's steps.
+
+    ttl : int or None, default=None
+        Number of seconds for which results are kept.
+
+    compression : str or None, default=None
+        Compression of the results; see `flask_worker.results.dumps`.
+    """
+    def __init__(self, connection, job_ids, ttl=None, compression=None):
+        self.connection, self.job_ids = connection, job_ids
+        self.ttl, self.compression = ttl, compression
+
+    def key(self, index):
+        return 'flask_worker:chain:' + self.job_ids[index]
+
+    def set(self, index, result):
+        """
+        Store the result of a step.
+        """
+        self.connection.set(
+            self.key(index), dumps(result, self.compression), ex=self.ttl
+        )
+
+    def results(self, indices):
+        """
+        Parameters
+        ----------
+        indices : tuple of int
+            Indices of steps.
+
+        Returns
+        -------
+        results : list
+            Results of the steps.
+        """
+        if not indices:
+            return []
+        data = self.connection.mget([self.key(i) for i in indices])
+        missing = [i for i, d in zip(indices, data) if d is None]
+        if missing:
+            raise RuntimeError(
+                'Results of steps {} of chain job {} are missing'.format(
+                    missing, self.job_ids[-1]
+                )
+            )
+        return [loads(d) for d in data]
+
+    def clear(self):
+        """
+        Delete the results of all steps.
+        """
+        self.connection.delete(
+            *[self.key(i) for i in range(len(self.job_ids))]
+        )
+
+    def abort(self):
+        """
+        Delete the chain's deferred jobs, which will never run, and the
+        results of its steps.
+        """
+        jobs = Job.fetch_many(self.job_ids, connection=self.connection)
+        with self.connection.pipeline() as pipe:
+            for job in jobs:
+                if job is not None and job.get_status() == 'deferred':
+                    job.delete(pipeline=pipe)
+            pipe.execute()
+        self.clear()
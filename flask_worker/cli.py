@@ -0,0 +1,103 @@
+"""# Command line interface
+
+The manager adds a `worker` command group to the application's `flask`
+command.
+
+Recover workers whose job is stuck in progress, once or every 60 seconds:
+
+```
+$ flask worker reap
+$ flask worker reap --interval 60
+```
+
+Run a pre-forking pool of 2 to 8 `rq` workers on two queues, recycling
+each worker after 500 jobs:
+
+```
+$ flask worker pool --processes 2 --max-processes 8 --queues high,default \
+    --max-jobs 500
+```
+"""
+
+from flask_worker.pool import WorkerPool
+
+from flask import current_app
+from flask.cli import AppGroup
+
+import click
+import logging
+import time
+
+worker_cli = AppGroup('worker', help='Manage Flask-Worker jobs.')
+
+
+@worker_cli.command('reap')
+@click.option(
+    '--interval', type=float, default=None,
+    help='Reap every INTERVAL seconds instead of once.'
+)
+@click.option(
+    '--no-requeue', is_flag=True,
+    help='Reset stuck workers instead of requeuing their jobs.'
+)
+def reap(interval, no_requeue):
+    """Recover workers whose job is stuck in progress."""
+    manager = current_app.extensions['manager']
+    while True:
+        counts = manager.reap_stuck_jobs(requeue=not no_requeue)
+        # start each pass with a fresh session
+        manager.db.session.remove()
+        click.echo(' '.join(
+            '{}={}'.format(key, value) for key, value in counts.items()
+        ))
+        if interval is None:
+            return
+        time.sleep(interval)
+
+
+@worker_cli.command('pool')
+@click.option(
+    '--processes', type=int, default=1, show_default=True,
+    help='Number of worker processes, or the minimum when autoscaling.'
+)
+@click.option(
+    '--max-processes', type=int, default=None,
+    help='Scale up to MAX_PROCESSES worker processes with the queue depth.'
+)
+@click.option(
+    '--queues', default=None,
+    help='Comma-separated names of the queues to listen on. Defaults to '
+    'the app\'s task queue and the manager\'s weighted queues.'
+)
+@click.option(
+    '--max-jobs', type=int, default=None,
+    help='Recycle a worker process after MAX_JOBS jobs.'
+)
+@click.option(
+    '--max-memory', type=float, default=None,
+    help='Recycle a worker process once it has used MAX_MEMORY megabytes.'
+)
+@click.option(
+    '--scale-interval', type=float, default=5, show_default=True,
+    help='Seconds between checks of the queue depth.'
+)
+@click.option(
+    '--logging-level', default='INFO', show_default=True,
+    help='Logging level of the workers.'
+)
+def pool(
+    processes, max_processes, queues, max_jobs, max_memory, scale_interval,
+    logging_level
+):
+    """Run a pre-forking pool of rq workers."""
+    logging.basicConfig(
+        level=logging_level, format='%(asctime)s %(message)s',
+        datefmt='%H:%M:%S'
+    )
+    WorkerPool(
+        current_app._get_current_object(),
+        queues=queues.split(',') if queues else None,
+        min_processes=processes, max_processes=max_processes,
+        max_jobs=max_jobs, max_memory=max_memory,
+        scale_interval=scale_interval, logging_level=logging_level
+    ).run()
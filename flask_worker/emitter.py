@@ -0,0 +1,157 @@
+"""# Emitter
+
+Standalone emitter of job notifications. It writes to the Redis message
+queue of the Flask-SocketIO server (the `message_queue` of
+`flask_socketio.SocketIO`), or publishes server-sent events, without a
+Flask application or a `SocketIO` object.
+
+Redis clients are shared per URL within a process, so every emitter and
+detached job in a process uses one connection pool per Redis server.
+"""
+
+from redis import Redis
+
+import json
+
+# Redis clients keyed by URL
+_connections = {}
+
+
+def get_connection(url):
+    """
+    Parameters
+    ----------
+    url : str
+        Redis URL.
+
+    Returns
+    -------
+    connection : redis.client.Redis
+        Redis client for the URL, shared within the process.
+    """
+    if url not in _connections:
+        _connections[url] = Redis.from_url(url)
+    return _connections[url]
+
+def connection_url(connection):
+    """
+    Parameters
+    ----------
+    connection : redis.client.Redis or None
+        Redis client.
+
+    Returns
+    -------
+    url : str or None
+        Redis URL from which another process connects to the client's 
+        server, or `None` if the server cannot be reached by URL.
+    """
+    if connection is None:
+        return None
+    for url, client in _connections.items():
+        if client is connection:
+            return url
+    pool = getattr(connection, 'connection_pool', None)
+    kwargs = getattr(pool, 'connection_kwargs', {})
+    auth = ''
+    if kwargs.get('password') is not None:
+        auth = '{}:{}@'.format(
+            kwargs.get('username') or '', kwargs['password']
+        )
+    if 'path' in kwargs:
+        return 'unix://{}{}?db={}'.format(
+            auth, kwargs['path'], kwargs.get('db', 0)
+        )
+    if 'host' not in kwargs:
+        return None
+    scheme = 'rediss' if 'ssl_cert_reqs' in kwargs else 'redis'
+    return '{}://{}{}:{}/{}'.format(
+        scheme, auth, kwargs['host'], kwargs.get('port', 6379), 
+        kwargs.get('db', 0)
+    )
+
+def channel(model_id):
+    """
+    Returns
+    -------
+    channel : str
+        Name of the Redis pub/sub channel for a worker's server-sent events.
+    """
+    return 'flask_worker:events:' + model_id
+
+
+class Emitter():
+    """
+    Sends job notifications to the clients of workers.
+
+    Parameters
+    ----------
+    url : str
+        Redis URL of the message queue.
+
+    transport : str, default='socketio'
+        `'socketio'` or `'sse'`. See `Manager.transport`.
+
+    namespace : str, default='/flask-worker'
+        Socket.IO namespace of the workers.
+
+    socketio_channel : str, default='flask-socketio'
+        Channel of the Flask-SocketIO message queue.
+
+    Examples
+    --------
+    ```python
+    from flask_worker.emitter import Emitter
+
+    emitter = Emitter('redis://')
+    emitter.emit('worker-1', 'job_finished')
+    ```
+    """
+    def __init__(
+        self, url, transport='socketio', namespace='/flask-worker',
+        socketio_channel='flask-socketio'
+    ):
+        self.url, self.transport = url, transport
+        self.namespace, self.socketio_channel = namespace, socketio_channel
+        self.connection = get_connection(url)
+        self._queue = None
+
+    @property
+    def queue(self):
+        # write-only Socket.IO message queue on the shared connection
+        if self._queue is None:
+            from socketio import RedisManager
+
+            queue = RedisManager(
+                self.url, channel=self.socketio_channel, write_only=True
+            )
+            queue.redis = self.connection
+            # newer python-socketio versions reconnect before publishing 
+            # unless the queue is marked connected
+            queue.connected = True
+            self._queue = queue
+        return self._queue
+
+    def emit(self, model_id, event, data=None):
+        """
+        Send a notification to the clients of a worker.
+
+        Parameters
+        ----------
+        model_id : str
+            Worker's `model_id`.
+
+        event : str
+            Name of the event, e.g. `'job_started'` or `'job_finished'`.
+
+        data : dict or None, default=None
+            JSON-serializable data sent with the event.
+        """
+        if self.transport == 'sse':
+            message = json.dumps(dict(event=event, data=data))
+            self.connection.publish(channel(model_id), message)
+        else:
+            self.queue.emit(
+                event, dict(model_id=model_id, data=data),
+                namespace=self.namespace, room=model_id
+            )
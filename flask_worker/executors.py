@@ -0,0 +1,304 @@
+"""# Executors
+
+Executors run the tasks enqueued by workers. The `RQExecutor` sends them to 
+the app's Redis queue, to be run by a separate `rq` worker process. The 
+`ThreadExecutor` and `AsyncioExecutor` run them inside the web process, 
+which avoids the queue and worker bootstrap overhead for short jobs and lets 
+tests and single-node deployments run without Redis.
+
+Local executors keep job statuses in memory, so the job status endpoints 
+only see jobs enqueued by the same process.
+"""
+
+from flask_worker import tasks
+
+from flask import current_app
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from rq.registry import FailedJobRegistry, StartedJobRegistry
+
+import asyncio
+import datetime
+import itertools
+import logging
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor as _ThreadPool
+from pydoc import locate
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+
+class RQExecutor():
+    """
+    Executes tasks with the app's Redis queue, `current_app.task_queue`.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection used to read job statuses.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def enqueue(self, f, kwargs, job_id=None, queue=None):
+        """
+        Enqueue a task.
+
+        Parameters
+        ----------
+        f : str
+            Import path of the task.
+
+        kwargs : dict
+            Keyword arguments passed to the task.
+
+        job_id : str or None, default=None
+            Identifier for the job. If `None`, a random id is generated.
+
+        queue : rq.Queue or None, default=None
+            Queue on which the task is enqueued. If `None`, it is enqueued 
+            on `current_app.task_queue`.
+
+        Returns
+        -------
+        job : rq.job.Job
+        """
+        queue = queue or current_app.task_queue
+        return queue.enqueue(f, kwargs=kwargs, job_id=job_id)
+
+    def statuses(self, job_ids):
+        """
+        Get the status and progress of many jobs with one pipelined Redis 
+        call. Only the job's status and meta fields are read.
+
+        Parameters
+        ----------
+        job_ids : list of str
+            Job identifiers.
+
+        Returns
+        -------
+        statuses : dict
+            Maps job ids to dictionaries with `status` and `progress` keys. 
+            The status is `None` if the job does not exist.
+        """
+        with self.connection.pipeline(transaction=False) as pipe:
+            for job_id in job_ids:
+                pipe.hmget(Job.key_for(job_id), 'status', 'meta')
+            results = pipe.execute()
+        statuses = {}
+        for job_id, (status, meta) in zip(job_ids, results):
+            meta = pickle.loads(meta) if meta else {}
+            statuses[job_id] = dict(
+                status=status.decode() if status else None,
+                progress=meta.get('progress')
+            )
+        return statuses
+
+    def result(self, job_id):
+        """
+        Parameters
+        ----------
+        job_id : str
+
+        Returns
+        -------
+        result :
+            Value returned by the job's task, or `None` if the job no longer 
+            exists, e.g. because its result expired.
+        """
+        try:
+            return Job.fetch(job_id, connection=self.connection).result
+        except NoSuchJobError:
+            return None
+
+    def requeue(self, job_id):
+        """
+        Requeue a failed or stuck job with the same id.
+
+        Parameters
+        ----------
+        job_id : str
+
+        Returns
+        -------
+        requeued : bool
+            Indicates that the job was requeued; `False` if it no longer 
+            exists.
+        """
+        try:
+            job = Job.fetch(job_id, connection=self.connection)
+        except NoSuchJobError:
+            return False
+        queue = Queue(job.origin, connection=self.connection)
+        for registry in (
+            StartedJobRegistry(queue=queue), FailedJobRegistry(queue=queue)
+        ):
+            registry.remove(job)
+        queue.enqueue_job(job)
+        return True
+
+
+class LocalJob():
+    """
+    Job run by a local executor. It mimics the parts of `rq.job.Job` used by 
+    Flask-Worker.
+
+    Parameters
+    ----------
+    job_id : str
+
+    Attributes
+    ----------
+    id : str
+        Set from the `job_id` parameter.
+
+    status : str
+        `'queued'`, `'started'`, `'finished'`, or `'failed'`.
+
+    meta : dict
+        Job metadata, e.g. its latest progress report.
+
+    result :
+        Value returned by the job's task.
+
+    enqueued_at : datetime.datetime
+        When the job was enqueued (UTC).
+    """
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status, self.meta, self.result = 'queued', {}, None
+        self.enqueued_at = datetime.datetime.utcnow()
+
+    def get_id(self):
+        return self.id
+
+    def save_meta(self):
+        # meta is kept in memory
+        pass
+
+
+class ThreadExecutor():
+    """
+    Executes tasks in a thread pool inside the web process.
+
+    Parameters
+    ----------
+    max_workers : int, default=4
+        Number of threads.
+
+    max_jobs : int, default=10000
+        Number of jobs whose status and result are remembered. The oldest 
+        jobs are forgotten first.
+    """
+    def __init__(self, max_workers=4, max_jobs=10000):
+        self.pool = _ThreadPool(max_workers)
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def enqueue(self, f, kwargs, job_id=None, queue=None):
+        """
+        Enqueue a task. See `RQExecutor.enqueue`.
+
+        Returns
+        -------
+        job : flask_worker.executors.LocalJob
+        """
+        # the task runs on this app, rather than a freshly imported one
+        tasks._apps.setdefault(
+            kwargs['app_import'], current_app._get_current_object()
+        )
+        job = LocalJob(job_id or str(uuid4()))
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        self.submit(job, locate(f), kwargs)
+        return job
+
+    def submit(self, job, func, kwargs):
+        self.pool.submit(self.run, job, func, kwargs)
+
+    def run(self, job, func, kwargs):
+        job.status, tasks._local.job = 'started', job
+        try:
+            job.result = func(**kwargs)
+            job.status = 'finished'
+        except Exception:
+            job.status = 'failed'
+            logger.exception('Job {} failed'.format(job.id))
+        finally:
+            tasks._local.job = None
+
+    def statuses(self, job_ids):
+        """
+        Get the status and progress of many jobs. See `RQExecutor.statuses`.
+        """
+        statuses = {}
+        for job_id in job_ids:
+            job = self.jobs.get(job_id)
+            statuses[job_id] = dict(
+                status=None if job is None else job.status,
+                progress=None if job is None else job.meta.get('progress')
+            )
+        return statuses
+
+    def result(self, job_id):
+        """
+        See `RQExecutor.result`.
+        """
+        job = self.jobs.get(job_id)
+        return None if job is None else job.result
+
+
+class AsyncioExecutor(ThreadExecutor):
+    """
+    Executes tasks with an asyncio event loop running in a background thread 
+    of the web process. Coroutine functions and methods are awaited on the 
+    event loop, so many of them can run concurrently on one thread, however 
+    many `max_workers` there are. Only the synchronous parts of a job (e.g. 
+    loading the worker and committing its state) run in a pool of threads; 
+    see `flask_worker.tasks.run_task_async`.
+
+    Parameters
+    ----------
+    max_workers : int, default=4
+        Number of threads for the synchronous parts of jobs.
+
+    max_jobs : int, default=10000
+        Number of jobs whose status and result are remembered.
+    """
+    def __init__(self, max_workers=4, max_jobs=10000):
+        super().__init__(max_workers, max_jobs)
+        # each job runs its synchronous parts on one thread, which keeps its 
+        # database connection on that thread
+        self.threads = itertools.cycle(
+            [_ThreadPool(1) for _ in range(max_workers)]
+        )
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+
+    def submit(self, job, func, kwargs):
+        if not hasattr(func, 'steps'):
+            # a task without steps to await runs in the thread pool
+            return super().submit(job, func, kwargs)
+        asyncio.run_coroutine_threadsafe(
+            self.run_async(job, func, kwargs, next(self.threads)), self.loop
+        )
+
+    async def run_async(self, job, func, kwargs, thread):
+        job.status = 'started'
+        try:
+            job.result = await tasks.run_task_async(
+                func, kwargs, job, executor=thread
+            )
+            job.status = 'finished'
+        except Exception:
+            job.status = 'failed'
+            logger.exception('Job {} failed'.format(job.id))
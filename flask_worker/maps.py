@@ -0,0 +1,179 @@
+"""# Map jobs
+
+A map job splits its input into chunks, each executed by a separate job, 
+and tracks the chunks in Redis. The job which completes the last chunk 
+collects the results, runs the reducer once, and finishes the worker.
+
+The state of a map job is a Redis hash with the number of chunks (`total`), 
+the number of completed chunks (`done`), its `status`, and, once it has 
+finished, its serialized `result`. Chunk results are kept in a second hash 
+until the map job finishes.
+"""
+
+from flask_worker.results import dumps, loads
+
+from uuid import uuid4
+
+MAP_ID_PREFIX = 'flask-worker-map-'
+
+
+def new_map_id():
+    return MAP_ID_PREFIX + uuid4().hex
+
+def is_map_id(job_id):
+    return job_id is not None and job_id.startswith(MAP_ID_PREFIX)
+
+def chunks(iterable, chunk_size):
+    """
+    Split an iterable into lists of at most `chunk_size` items.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class MapState():
+    """
+    State of a map job in Redis.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection.
+
+    map_id : str
+        Identifier of the map job.
+
+    ttl : int or None, default=None
+        Number of seconds for which the state is kept.
+    """
+    def __init__(self, connection, map_id, ttl=None):
+        self.connection, self.map_id, self.ttl = connection, map_id, ttl
+        self.key = 'flask_worker:map:' + map_id
+        self.results_key = self.key + ':results'
+
+    def create(self, total):
+        """
+        Create the state of a map job with `total` chunks.
+        """
+        with self.connection.pipeline() as pipe:
+            pipe.delete(self.key, self.results_key)
+            pipe.hset(
+                self.key, mapping=dict(total=total, done=0, status='queued')
+            )
+            if self.ttl is not None:
+                pipe.expire(self.key, self.ttl)
+            pipe.execute()
+
+    def start(self):
+        """
+        Mark the map job as started.
+
+        Returns
+        -------
+        first : bool
+            Indicates that this is the first chunk to start.
+        """
+        with self.connection.pipeline() as pipe:
+            pipe.hsetnx(self.key, 'started', 1)
+            pipe.hset(self.key, 'status', 'started')
+            return bool(pipe.execute()[0])
+
+    def finish_chunk(self, index, results):
+        """
+        Store the results of a chunk and count it as done.
+
+        Returns
+        -------
+        done, total : int
+            Numbers of completed and total chunks. Exactly one chunk sees 
+            `done == total`.
+        """
+        with self.connection.pipeline() as pipe:
+            pipe.hset(self.results_key, index, dumps(results))
+            if self.ttl is not None:
+                pipe.expire(self.results_key, self.ttl)
+            pipe.hincrby(self.key, 'done')
+            pipe.hget(self.key, 'total')
+            *_, done, total = pipe.execute()
+        return done, int(total)
+
+    def collect(self):
+        """
+        Returns
+        -------
+        results : list
+            Results of all chunks, in the order of the map's input.
+        """
+        chunk_results = self.connection.hgetall(self.results_key)
+        results = []
+        for index in sorted(chunk_results, key=int):
+            results.extend(loads(chunk_results[index]))
+        return results
+
+    def finish(self, result):
+        """
+        Mark the map job as finished with its final result, and delete the 
+        chunk results.
+        """
+        with self.connection.pipeline() as pipe:
+            pipe.hset(self.key, mapping=dict(
+                status='finished', result=dumps(result)
+            ))
+            pipe.delete(self.results_key)
+            pipe.execute()
+
+    def fail(self):
+        """
+        Mark the map job as failed.
+        """
+        self.connection.hset(self.key, 'status', 'failed')
+
+    def failed(self):
+        """
+        Returns
+        -------
+        failed : bool
+            Indicates that a chunk of the map job failed or was cancelled.
+        """
+        return self.connection.hget(self.key, 'status') == b'failed'
+
+    def result(self):
+        """
+        Returns
+        -------
+        result :
+            Final result of the map job, or `None` if it has not finished.
+        """
+        data = self.connection.hget(self.key, 'result')
+        return None if data is None else loads(data)
+
+    @classmethod
+    def statuses(cls, connection, map_ids):
+        """
+        Get the status and progress of many map jobs with one pipelined Redis 
+        call. See `flask_worker.Manager.job_statuses`.
+        """
+        with connection.pipeline(transaction=False) as pipe:
+            for map_id in map_ids:
+                key = cls(connection, map_id).key
+                pipe.hmget(key, 'status', 'done', 'total')
+            results = pipe.execute()
+        statuses = {}
+        for map_id, (status, done, total) in zip(map_ids, results):
+            if status is None:
+                statuses[map_id] = dict(status=None, progress=None)
+                continue
+            done, total = int(done), int(total)
+            # a map over an empty iterable has no chunks, and is complete
+            fraction = done/total if total else 1.
+            statuses[map_id] = dict(
+                status=status.decode(),
+                progress=dict(fraction=fraction, message=None)
+            )
+        return statuses
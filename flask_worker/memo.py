@@ -0,0 +1,159 @@
+"""# Memoization
+
+Cache of function results shared across requests and workers. Entries are 
+keyed on the function's import path and a stable hash of its arguments, 
+stored in Redis with a TTL, and evicted least-recently-used first once the 
+cache holds more than `max_entries` entries.
+"""
+
+from flask_worker.results import dumps
+
+import hashlib
+import pickle
+import time
+
+
+def _canonical(obj):
+    # equal dicts and sets may pickle differently, since their order depends 
+    # on insertion and, for strings, on the process's hash seed; replace 
+    # them with sorted tuples
+    if isinstance(obj, dict):
+        return (type(obj).__name__, _sorted(
+            (_canonical(key), _canonical(val)) for key, val in obj.items()
+        ))
+    if isinstance(obj, (set, frozenset)):
+        return (type(obj).__name__, _sorted(_canonical(i) for i in obj))
+    if type(obj) in (list, tuple):
+        return type(obj)(_canonical(i) for i in obj)
+    return obj
+
+def _sorted(items):
+    # sort items of any types by their pickles
+    return tuple(sorted(items, key=lambda i: pickle.dumps(i, protocol=4)))
+
+def call_hash(*args, **kwargs):
+    """
+    Hash arguments into a hex digest which is stable across processes. 
+    Arguments must be picklable; functions and classes are hashed by their 
+    import paths. Dicts and sets are hashed independently of their order.
+    """
+    data = pickle.dumps(_canonical((args, kwargs)), protocol=4)
+    return hashlib.sha1(data).hexdigest()
+
+
+class Memo():
+    """
+    Redis-backed memoization cache.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection.
+
+    ttl : int or None, default=None
+        Number of seconds for which entries are kept.
+
+    max_entries : int or None, default=None
+        Maximum number of entries. If `None`, the size of the cache is 
+        bounded only by the `ttl`.
+
+    compression : str or None, default=None
+        `'zlib'`, `'lz4'`, or `None` for no compression.
+
+    prefix : str, default='flask_worker:memo:'
+        Prefix of the Redis keys.
+    """
+    def __init__(
+            self, connection, ttl=None, max_entries=None, compression=None,
+            prefix='flask_worker:memo:'
+        ):
+        self.connection = connection
+        self.ttl, self.max_entries = ttl, max_entries
+        self.compression = compression
+        self.prefix = prefix
+        self.lru_key, self.stats_key = prefix+'lru', prefix+'stats'
+
+    def key(self, func, args, kwargs):
+        """
+        Parameters
+        ----------
+        func : callable
+            Function whose call is cached.
+
+        args : tuple
+        
+        kwargs : dict
+
+        Returns
+        -------
+        key : str
+            Redis key for the function call.
+        """
+        return self.prefix + call_hash(func, *args, **kwargs)
+
+    def get(self, key):
+        """
+        Get a cached result and count the hit or miss.
+
+        Parameters
+        ----------
+        key : str
+            Key returned by `self.key`.
+
+        Returns
+        -------
+        data : bytes or None
+            Serialized result (see `flask_worker.results.loads`), or `None` 
+            on a miss.
+        """
+        data = self.connection.get(key)
+        with self.connection.pipeline(transaction=False) as pipe:
+            if data is None:
+                pipe.hincrby(self.stats_key, 'misses')
+            else:
+                pipe.hincrby(self.stats_key, 'hits')
+                pipe.zadd(self.lru_key, {key: time.time()})
+            pipe.execute()
+        return data
+
+    def set(self, key, result):
+        """
+        Cache a result, evicting the least recently used entries if the cache 
+        is full.
+
+        Parameters
+        ----------
+        key : str
+            Key returned by `self.key`.
+
+        result :
+            Picklable result.
+        """
+        with self.connection.pipeline(transaction=False) as pipe:
+            pipe.set(key, dumps(result, self.compression), ex=self.ttl)
+            pipe.zadd(self.lru_key, {key: time.time()})
+            pipe.zcard(self.lru_key)
+            size = pipe.execute()[-1]
+        if self.max_entries is None or size <= self.max_entries:
+            return
+        evicted = self.connection.zrange(
+            self.lru_key, 0, size-self.max_entries-1
+        )
+        with self.connection.pipeline(transaction=False) as pipe:
+            pipe.delete(*evicted)
+            pipe.zrem(self.lru_key, *evicted)
+            pipe.hincrby(self.stats_key, 'evictions', len(evicted))
+            pipe.execute()
+
+    def stats(self):
+        """
+        Returns
+        -------
+        stats : dict
+            Numbers of `hits`, `misses`, and `evictions`.
+        """
+        stats = self.connection.hgetall(self.stats_key)
+        return {
+            name: int(stats.get(name.encode(), 0))
+            for name in ('hits', 'misses', 'evictions')
+        }
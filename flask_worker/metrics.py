@@ -0,0 +1,331 @@
+"""# Metrics
+
+Job latency instrumentation. For every job, the job manager timestamps each 
+phase: enqueuing (in the web process), waiting in the queue, preparing the 
+job, executing the task, and finishing the job. If the loading page reports 
+that the client reached its callback, the time from finishing the job to the 
+client's callback is recorded too. The wait in the queue is also recorded 
+per queue.
+
+Timings are stored in the job's meta, aggregated into histograms (in Redis, 
+so the web process sees the timings recorded by every worker process), and 
+passed to callbacks registered with `Manager.on_job_timings`. Metrics are 
+exported in the Prometheus text format by the `_worker_metrics` view 
+function.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+DEFAULT_BUCKETS = (
+    .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300
+)
+PHASES = (
+    'enqueue', 'queue_wait', 'prepare', 'execute', 'finish', 'total', 
+    'callback'
+)
+
+
+def job_name(func=None, model_cls=None, method_name=None):
+    """
+    Name of the function or model method executed by a job, used to label 
+    per-function metrics.
+    """
+    if func is not None:
+        return '{}.{}'.format(
+            getattr(func, '__module__', None), 
+            getattr(func, '__qualname__', type(func).__name__)
+        )
+    return '{}.{}.{}'.format(
+        model_cls.__module__, model_cls.__qualname__, method_name
+    )
+
+
+class Metrics():
+    """
+    Histograms of job phase durations and per-function job counters.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis or None, default=None
+        Redis connection in which metrics are aggregated. If `None`, metrics 
+        are kept in the memory of the current process.
+
+    buckets : tuple of float, default=DEFAULT_BUCKETS
+        Upper bounds of the histogram buckets, in seconds.
+
+    prefix : str, default='flask_worker:metrics:'
+        Prefix of the Redis keys.
+
+    Attributes
+    ----------
+    callbacks : list of callable
+        Called with `(job_id, name, timings)` whenever a job's timings are 
+        recorded. `timings` maps phase names to durations in seconds.
+    """
+    def __init__(
+            self, connection=None, buckets=DEFAULT_BUCKETS, 
+            prefix='flask_worker:metrics:'
+        ):
+        self.connection = connection
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self.callbacks = []
+        self._memory = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def _incr_many(self, increments):
+        # increments is a list of (key, field, amount) tuples
+        if self.connection is None:
+            with self._lock:
+                for key, field, amount in increments:
+                    self._memory[key][field] += amount
+            return
+        with self.connection.pipeline(transaction=False) as pipe:
+            for key, field, amount in increments:
+                pipe.hincrbyfloat(self.prefix+key, field, amount)
+            pipe.execute()
+
+    def _set(self, key, field, value):
+        if self.connection is None:
+            with self._lock:
+                self._memory[key][field] = value
+            return
+        self.connection.hset(self.prefix+key, field, value)
+
+    def _getall(self, key):
+        if self.connection is None:
+            with self._lock:
+                return dict(self._memory.get(key, {}))
+        return {
+            field.decode(): float(value) for field, value 
+            in self.connection.hgetall(self.prefix+key).items()
+        }
+
+    def _observations(self, phase, seconds):
+        # increments of one histogram observation
+        le = next((b for b in self.buckets if seconds <= b), '+Inf')
+        key = 'hist:' + phase
+        return [(key, str(le), 1), (key, 'sum', seconds), (key, 'count', 1)]
+
+    def observe(self, phase, seconds):
+        """
+        Record the duration of a phase.
+
+        Parameters
+        ----------
+        phase : str
+
+        seconds : float
+        """
+        self._incr_many(self._observations(phase, seconds))
+
+    def count(self, event, name):
+        """
+        Count a job event for a function.
+
+        Parameters
+        ----------
+        event : str
+            e.g. `'enqueued'`, `'finished'`, `'failed'`, or `'cancelled'`.
+
+        name : str
+            Name of the function or method executed by the job.
+        """
+        self._incr_many([('counter:'+event, name, 1)])
+
+    def record_job(self, job_id, name, timings, queue=None):
+        """
+        Record the timings of a finished job, count it as finished, and call 
+        the callbacks. If the job's `queue` is given, its wait in the queue 
+        is recorded for the queue too.
+
+        Parameters
+        ----------
+        job_id : str
+
+        name : str
+            Name of the function or method executed by the job.
+
+        timings : dict
+            Maps phase names to durations in seconds.
+
+        queue : str or None, default=None
+            Name of the queue from which the job was dequeued.
+        """
+        increments = [('counter:finished', name, 1)]
+        for phase, seconds in timings.items():
+            increments += self._observations(phase, seconds)
+        if queue is not None and 'queue_wait' in timings:
+            increments.append(('queues', queue, 1))
+            increments += self._observations(
+                'queue_wait:'+queue, timings['queue_wait']
+            )
+        self._incr_many(increments)
+        [callback(job_id, name, timings) for callback in self.callbacks]
+
+    def mark_finished(self, job_id, ttl=3600):
+        """
+        Remember when a job finished, to time the client's callback.
+        """
+        if self.connection is not None:
+            self.connection.set(
+                self.prefix+'finished:'+job_id, time.time(), ex=ttl
+            )
+
+    def record_callback(self, job_id):
+        """
+        Record the time from finishing a job to the client reaching its 
+        callback.
+        """
+        if self.connection is None:
+            return
+        key = self.prefix+'finished:'+job_id
+        with self.connection.pipeline() as pipe:
+            pipe.get(key)
+            pipe.delete(key)
+            finished_at = pipe.execute()[0]
+        if finished_at is not None:
+            self.observe('callback', time.time()-float(finished_at))
+
+    def record_reap(self, counts):
+        """
+        Record a pass of the stuck job reaper.
+
+        Parameters
+        ----------
+        counts : dict
+            Returned by `Manager.reap_stuck_jobs`.
+        """
+        self._set('reaper', 'stuck', counts['stuck'])
+        self._incr_many([
+            ('counter:reaped', action, counts[action]) 
+            for action in ('requeued', 'reset', 'exhausted')
+        ])
+
+    def mean(self, phase):
+        """
+        Parameters
+        ----------
+        phase : str
+
+        Returns
+        -------
+        seconds : float or None
+            Mean duration of the phase, or `None` if it was never recorded.
+        """
+        hist = self._getall('hist:'+phase)
+        if not hist.get('count'):
+            return None
+        return hist['sum'] / hist['count']
+
+    def queue_waits(self):
+        """
+        Returns
+        -------
+        waits : dict
+            Maps the names of queues from which jobs were dequeued to the 
+            mean number of seconds the jobs waited in them.
+        """
+        return {
+            queue: self.mean('queue_wait:'+queue) 
+            for queue in sorted(self._getall('queues'))
+        }
+
+    def prometheus(self, queue_depths=None):
+        """
+        Export the metrics in the Prometheus text format.
+
+        Parameters
+        ----------
+        queue_depths : dict or None, default=None
+            Maps queue names to the number of jobs waiting in them.
+
+        Returns
+        -------
+        text : str
+        """
+        lines = [
+            '# HELP flask_worker_job_phase_seconds Duration of job phases.',
+            '# TYPE flask_worker_job_phase_seconds histogram'
+        ]
+        for phase in PHASES:
+            hist = self._getall('hist:'+phase)
+            cumulative = 0
+            for le in self.buckets + ('+Inf',):
+                cumulative += hist.get(str(le), 0)
+                lines.append(
+                    'flask_worker_job_phase_seconds_bucket'
+                    '{{phase="{}",le="{}"}} {:g}'.format(phase, le, cumulative)
+                )
+            for stat in ('sum', 'count'):
+                value = hist.get(stat, 0)
+                lines.append(
+                    'flask_worker_job_phase_seconds_{}'
+                    '{{phase="{}"}} {:g}'.format(stat, phase, value)
+                )
+        lines += [
+            '# HELP flask_worker_jobs_total Job events by function.',
+            '# TYPE flask_worker_jobs_total counter'
+        ]
+        for event in ('enqueued', 'finished', 'failed', 'cancelled'):
+            for name, value in sorted(self._getall('counter:'+event).items()):
+                lines.append(
+                    'flask_worker_jobs_total'
+                    '{{event="{}",function="{}"}} {:g}'.format(
+                        event, name, value
+                    )
+                )
+        lines += [
+            '# HELP flask_worker_stuck_jobs Stuck jobs found by the last '
+            'reaper pass.',
+            '# TYPE flask_worker_stuck_jobs gauge',
+            'flask_worker_stuck_jobs {:g}'.format(
+                self._getall('reaper').get('stuck', 0)
+            ),
+            '# HELP flask_worker_reaped_jobs_total Stuck jobs recovered by '
+            'the reaper.',
+            '# TYPE flask_worker_reaped_jobs_total counter'
+        ]
+        reaped = self._getall('counter:reaped')
+        for action in ('requeued', 'reset', 'exhausted'):
+            lines.append(
+                'flask_worker_reaped_jobs_total{{action="{}"}} {:g}'.format(
+                    action, reaped.get(action, 0)
+                )
+            )
+        queues = sorted(self._getall('queues'))
+        if queues:
+            lines += [
+                '# HELP flask_worker_queue_wait_seconds Time jobs waited in '
+                'a queue.',
+                '# TYPE flask_worker_queue_wait_seconds histogram'
+            ]
+        for queue in queues:
+            hist = self._getall('hist:queue_wait:'+queue)
+            cumulative = 0
+            for le in self.buckets + ('+Inf',):
+                cumulative += hist.get(str(le), 0)
+                lines.append(
+                    'flask_worker_queue_wait_seconds_bucket'
+                    '{{queue="{}",le="{}"}} {:g}'.format(queue, le, cumulative)
+                )
+            for stat in ('sum', 'count'):
+                value = hist.get(stat, 0)
+                lines.append(
+                    'flask_worker_queue_wait_seconds_{}'
+                    '{{queue="{}"}} {:g}'.format(stat, queue, value)
+                )
+        if queue_depths:
+            lines += [
+                '# HELP flask_worker_queue_depth Jobs waiting in a queue.',
+                '# TYPE flask_worker_queue_depth gauge'
+            ]
+            for queue, depth in sorted(queue_depths.items()):
+                lines.append(
+                    'flask_worker_queue_depth{{queue="{}"}} {}'.format(
+                        queue, depth
+                    )
+                )
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,275 @@
+"""# Worker pool
+
+Pre-forking pool of `rq` workers. The parent process imports the Flask
+application and warms its caches once, then forks child processes which
+share its memory copy-on-write. Each child runs a non-forking worker, so
+jobs run on the already-imported application without a fork per job.
+
+Children are recycled (replaced by a fresh fork of the parent) after
+`max_jobs` jobs, or once their peak memory exceeds `max_memory`. Every
+`scale_interval` seconds, the pool sets the number of children to the
+number of queued and started jobs, between `min_processes` and
+`max_processes`. Children drain their queues in the order weighted by 
+the manager's `queue_weights`.
+
+Run the pool with the `flask worker pool` command:
+
+```
+$ flask worker pool --processes 2 --max-processes 8 --max-jobs 500
+```
+"""
+
+from flask_worker.rq_worker import WeightedSimpleAppWorker
+from flask_worker import tasks
+
+from rq import Queue
+from rq.registry import StartedJobRegistry
+from sqlalchemy.orm import configure_mappers
+
+import gc
+import logging
+import os
+import resource
+import signal
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def peak_memory():
+    """
+    Returns
+    -------
+    megabytes : float
+        Peak resident memory of the current process.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+class PoolWorker(WeightedSimpleAppWorker):
+    """
+    Worker run by a child of the pool. It stops after the job during which
+    its peak memory exceeded `max_memory` megabytes.
+    """
+    max_memory = None
+
+    def _install_signal_handlers(self):
+        # the parent forwards SIGINT (e.g. Ctrl+C in a terminal, which also
+        # reaches the children) as SIGTERM, so a single SIGINT is a warm
+        # shutdown; a second one, once stopping, is a cold shutdown
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self.request_stop)
+
+    def execute_job(self, job, queue):
+        result = super().execute_job(job, queue)
+        if self.max_memory and peak_memory() > self.max_memory:
+            self.log.info(
+                'Worker {} exceeded {} MB; recycling'.format(
+                    self.name, self.max_memory
+                )
+            )
+            self._stop_requested = True
+        return result
+
+
+class WorkerPool():
+    """
+    Pre-forking pool of `rq` workers.
+
+    Parameters
+    ----------
+    app : flask.app.Flask
+        Application with a Flask-Worker manager.
+
+    queues : list of str or None, default=None
+        Names of the queues the workers listen on. If `None`, they listen
+        on the manager's queues; see `Manager.queue_names`.
+
+    min_processes : int, default=1
+        Minimum number of children.
+
+    max_processes : int or None, default=None
+        Maximum number of children. If `None`, the pool keeps
+        `min_processes` children.
+
+    max_jobs : int or None, default=None
+        Number of jobs after which a child is recycled.
+
+    max_memory : float or None, default=None
+        Peak memory, in megabytes, above which a child is recycled.
+
+    scale_interval : float, default=5
+        Number of seconds between checks of the queue depth.
+
+    logging_level : str, default='INFO'
+        Logging level of the children's `rq` workers.
+    """
+    def __init__(
+        self, app, queues=None, min_processes=1, max_processes=None,
+        max_jobs=None, max_memory=None, scale_interval=5,
+        logging_level='INFO'
+    ):
+        self.app = app
+        self.manager = app.extensions['manager']
+        self.connection = app.task_queue.connection
+        if queues is None:
+            with app.app_context():
+                queues = self.manager.queue_names
+        self.queue_names = queues
+        self.min_processes = min_processes
+        self.max_processes = max(max_processes or 0, min_processes)
+        self.max_jobs, self.max_memory = max_jobs, max_memory
+        self.scale_interval = scale_interval
+        self.logging_level = logging_level
+        # maps the pids of live children to the time they were forked
+        self.children = {}
+        # children which were asked to stop when scaling down
+        self.retiring = set()
+        self.target = min_processes
+        self._stopping = False
+
+    @property
+    def queues(self):
+        return [
+            Queue(name, connection=self.connection)
+            for name in self.queue_names
+        ]
+
+    def preload(self):
+        """
+        Register the pool's application for its jobs and warm its caches 
+        before forking.
+        """
+        manager = self.manager
+        # jobs look up the application by import path; reuse the pool's
+        tasks._apps.setdefault(manager.app_import, self.app)
+        with self.app.app_context():
+            configure_mappers()
+            manager.task_executor
+            # children open their own database connections
+            manager.db.engine.dispose()
+        if hasattr(gc, 'freeze'):
+            # keep the garbage collector from touching, and so copying, the
+            # parent's objects
+            gc.freeze()
+
+    def queue_depth(self):
+        """
+        Returns
+        -------
+        depth : int
+            Number of queued and started jobs in the pool's queues.
+        """
+        with self.connection.pipeline(transaction=False) as pipe:
+            for queue in self.queues:
+                pipe.llen(queue.key)
+                pipe.zcard(StartedJobRegistry(queue=queue).key)
+            return sum(pipe.execute())
+
+    def scale(self):
+        """
+        Set the target number of children from the queue depth.
+        """
+        depth = self.queue_depth()
+        target = min(max(depth, self.min_processes), self.max_processes)
+        if target != self.target:
+            logger.info('Scaling pool from {} to {} children'.format(
+                self.target, target
+            ))
+        self.target = target
+
+    def spawn(self):
+        """
+        Fork a child which runs a worker until it is recycled or stopped.
+        """
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return pid
+        code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            worker = PoolWorker(self.queues, connection=self.connection)
+            worker.max_memory = self.max_memory
+            worker.queue_weights = self.manager.queue_weights
+            worker.work(
+                logging_level=self.logging_level, max_jobs=self.max_jobs
+            )
+        except Exception:
+            logger.exception('Pool worker crashed')
+            code = 1
+        finally:
+            # skip the parent's exit handlers
+            os._exit(code)
+
+    def reap_children(self):
+        """
+        Forget children which exited.
+        """
+        while self.children:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                return
+            self.children.pop(pid, None)
+            self.retiring.discard(pid)
+
+    def adjust(self):
+        """
+        Fork or retire children to reach the target.
+        """
+        active = [pid for pid in self.children if pid not in self.retiring]
+        for _ in range(self.target - len(active)):
+            self.spawn()
+        # retire the newest children first; they finish their current job
+        active.sort(key=self.children.get)
+        for pid in active[self.target:]:
+            self.stop_child(pid)
+
+    def stop_child(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        self.retiring.add(pid)
+
+    def stop(self, signum=None, frame=None):
+        self._stopping = True
+
+    def run(self, poll_interval=1):
+        """
+        Preload the application and run the pool until it receives SIGINT
+        or SIGTERM. Children finish their current job before they exit.
+
+        Parameters
+        ----------
+        poll_interval : float, default=1
+            Number of seconds between checks of the children.
+        """
+        self.preload()
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        scaled_at = 0
+        while not self._stopping:
+            self.reap_children()
+            if (
+                self.max_processes > self.min_processes
+                and time.time() - scaled_at >= self.scale_interval
+            ):
+                self.scale()
+                scaled_at = time.time()
+            self.adjust()
+            time.sleep(poll_interval)
+        [
+            self.stop_child(pid) for pid in list(self.children)
+            if pid not in self.retiring
+        ]
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, 0)
+            except ChildProcessError:
+                return
+            self.children.pop(pid, None)
@@ -0,0 +1,235 @@
+"""# Recovery
+
+Recovery of workers whose job is stuck in progress, e.g. because the `rq`
+worker running it died before it could finish the job.
+
+While a job runs, its job manager refreshes a heartbeat key in Redis every
+`heartbeat_interval` seconds. The reaper looks at every worker with a job in
+progress. A worker is stuck if its job failed, if its job no longer exists,
+or if its job was started but its heartbeat expired. The job of a job chain
+is also stuck if it is deferred while a step before it failed, or while no
+step before it is queued or alive. Missing, stale, and stalled jobs are only
+reaped when they are seen on two consecutive passes, so jobs which are being
+enqueued or are starting up are left alone.
+
+Stuck jobs are requeued if the executor still has them, except for job
+chains, whose remaining jobs are deleted. Otherwise the worker is reset, and
+its loading page reloads and enqueues the job again.
+After `reaper_max_retries` recoveries without a finished job in between,
+the reaper gives up: the worker is reset and its loading page receives a
+`job_failed` event, which shows an error instead of reloading. The next
+visit to the worker's page enqueues the job again.
+
+Run the reaper with the `flask worker reap` command, or call
+`Manager.reap_stuck_jobs` from a periodic task.
+"""
+
+from flask_worker.chains import ChainState, chain_of, is_chain_id
+from flask_worker.maps import is_map_id
+
+import threading
+
+HEARTBEAT_PREFIX = 'flask_worker:heartbeat:'
+
+
+def heartbeat_key(job_id):
+    return HEARTBEAT_PREFIX + job_id
+
+
+class Heartbeat(threading.Thread):
+    """
+    Daemon thread which refreshes a running job's heartbeat. The heartbeat
+    expires if it is not refreshed for three intervals.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection.
+
+    job_id : str
+
+    interval : float
+        Number of seconds between heartbeats.
+    """
+    def __init__(self, connection, job_id, interval):
+        super().__init__(daemon=True, name='flask-worker-heartbeat')
+        self.connection, self.interval = connection, interval
+        self.key = heartbeat_key(job_id)
+        self.stopped = threading.Event()
+
+    def beat(self):
+        self.connection.set(self.key, 1, ex=int(3*self.interval)+1)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def stop(self):
+        self.stopped.set()
+        self.connection.delete(self.key)
+
+
+class Reaper():
+    """
+    Finds and recovers workers whose job is stuck in progress.
+
+    Parameters
+    ----------
+    manager : flask_worker.Manager
+    """
+    suspects_key = 'flask_worker:reaper:suspects'
+    retries_prefix = 'flask_worker:reaper:retries:'
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.connection = manager.connection
+
+    def stuck_workers(self, workers):
+        """
+        Parameters
+        ----------
+        workers : list of flask_worker.WorkerMixin
+            Workers with a job in progress.
+
+        Returns
+        -------
+        stuck : list of flask_worker.WorkerMixin
+            Workers whose job failed, or whose job was missing, stale, or a
+            stalled chain on this and the previous pass.
+        """
+        # the steps before the last step of each job chain
+        steps = {
+            w.job_id: chain_of(w.job_id)[:-1] for w in workers
+            if is_chain_id(w.job_id)
+        }
+        job_ids = [w.job_id for w in workers]
+        job_ids += [job_id for ids in steps.values() for job_id in ids]
+        statuses = self.manager.job_statuses(job_ids)
+        started = [
+            job_id for job_id in job_ids
+            if statuses[job_id]['status'] == 'started'
+            and not is_map_id(job_id)
+        ]
+        if started and self.manager.heartbeat_interval:
+            pipe = self.connection.pipeline(transaction=False)
+            [pipe.exists(heartbeat_key(job_id)) for job_id in started]
+            alive = {
+                job_id for job_id, exists in zip(started, pipe.execute())
+                if exists
+            }
+        else:
+            # without heartbeats, started jobs are never stale
+            alive = set(started)
+        stuck, suspects = [], []
+        for worker in workers:
+            status = statuses[worker.job_id]['status']
+            if status == 'deferred' and worker.job_id in steps:
+                step_statuses = [
+                    statuses[job_id]['status']
+                    for job_id in steps[worker.job_id]
+                ]
+                if 'failed' in step_statuses:
+                    stuck.append(worker)
+                elif not any(
+                    step_status == 'queued' or job_id in alive
+                    for job_id, step_status
+                    in zip(steps[worker.job_id], step_statuses)
+                ):
+                    # no step is running, so the chain never finishes
+                    suspects.append(worker)
+            elif status == 'failed':
+                stuck.append(worker)
+            elif status is None or (
+                status == 'started' and worker.job_id not in alive
+                and not is_map_id(worker.job_id)
+            ):
+                suspects.append(worker)
+        previous = {
+            job_id.decode()
+            for job_id in self.connection.smembers(self.suspects_key)
+        }
+        stuck += [w for w in suspects if w.job_id in previous]
+        with self.connection.pipeline() as pipe:
+            pipe.delete(self.suspects_key)
+            if suspects:
+                pipe.sadd(self.suspects_key, *[w.job_id for w in suspects])
+                pipe.expire(self.suspects_key, 86400)
+            pipe.execute()
+        return stuck
+
+    def reap(self, workers, requeue=True):
+        """
+        Recover stuck workers.
+
+        Parameters
+        ----------
+        workers : list of flask_worker.WorkerMixin
+            Workers with a job in progress.
+
+        requeue : bool, default=True
+            Indicates that stuck jobs are requeued if the executor still has
+            them. If `False`, stuck workers are always reset.
+
+        Returns
+        -------
+        counts : dict
+            Numbers of `stuck` workers, and of workers whose job was
+            `requeued`, which were `reset`, and which failed after
+            `exhausted` retries.
+        """
+        counts = dict(stuck=0, requeued=0, reset=0, exhausted=0)
+        if not workers:
+            return counts
+        stuck = self.stuck_workers(workers)
+        counts['stuck'] = len(stuck)
+        if not stuck:
+            return counts
+        pipe = self.connection.pipeline(transaction=False)
+        [pipe.incr(self.retries_prefix+worker.model_id) for worker in stuck]
+        retries = pipe.execute()
+        first = [
+            worker for worker, n_retries in zip(stuck, retries)
+            if n_retries == 1
+        ]
+        if first:
+            # counters expire after their first retry, rather than after
+            # their latest
+            pipe = self.connection.pipeline(transaction=False)
+            [
+                pipe.expire(
+                    self.retries_prefix+worker.model_id,
+                    self.manager.result_ttl or 86400
+                )
+                for worker in first
+            ]
+            pipe.execute()
+        executor_requeue = getattr(self.manager.task_executor, 'requeue', None)
+        events = []
+        for worker, n_retries in zip(stuck, retries):
+            job_id = worker.job_id
+            if is_chain_id(job_id):
+                # a chain is not requeued; its deferred jobs and results
+                # are useless
+                ChainState(self.connection, chain_of(job_id)).abort()
+            if n_retries > self.manager.reaper_max_retries:
+                # give up; the client shows the failure, and the next visit
+                # starts over
+                self.manager.release_job(job_id)
+                self.connection.delete(self.retries_prefix+worker.model_id)
+                worker.reset()
+                events.append((worker.model_id, 'job_failed'))
+                counts['exhausted'] += 1
+            elif (
+                requeue and executor_requeue is not None
+                and not is_chain_id(job_id) and executor_requeue(job_id)
+            ):
+                counts['requeued'] += 1
+            else:
+                # the client's loading page reloads and enqueues the job
+                self.manager.release_job(job_id)
+                worker.reset()
+                events.append((worker.model_id, 'job_cancelled'))
+                counts['reset'] += 1
+        self.manager.db.session.commit()
+        [self.manager.notify(model_id, event) for model_id, event in events]
+        return counts
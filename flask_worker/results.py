@@ -0,0 +1,223 @@
+"""# Result stores
+
+Result stores keep the results of workers' jobs outside of the application 
+database, under a key per job. Results are pickled with the highest protocol 
+and optionally compressed with zlib or lz4. The first byte of a stored 
+payload records its compression, so payloads stay readable after the 
+manager's `result_compression` setting changes.
+"""
+
+import os
+import pickle
+import time
+import zlib
+
+COMPRESSION_FLAGS = {None: b'0', 'zlib': b'z', 'lz4': b'l'}
+
+
+def dumps(result, compression=None):
+    """
+    Serialize a result.
+
+    Parameters
+    ----------
+    result : 
+        Picklable result.
+
+    compression : str or None, default=None
+        `'zlib'`, `'lz4'`, or `None` for no compression.
+
+    Returns
+    -------
+    data : bytes
+    """
+    if compression not in COMPRESSION_FLAGS:
+        raise ValueError('Unknown compression {}'.format(compression))
+    data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    if compression == 'zlib':
+        data = zlib.compress(data)
+    elif compression == 'lz4':
+        import lz4.frame
+        data = lz4.frame.compress(data)
+    return COMPRESSION_FLAGS[compression] + data
+
+def loads(data):
+    """
+    Deserialize a result serialized by `dumps`.
+
+    Parameters
+    ----------
+    data : bytes
+
+    Returns
+    -------
+    result :
+    """
+    flag, data = data[:1], data[1:]
+    if flag == COMPRESSION_FLAGS['zlib']:
+        data = zlib.decompress(data)
+    elif flag == COMPRESSION_FLAGS['lz4']:
+        import lz4.frame
+        data = lz4.frame.decompress(data)
+    return pickle.loads(data)
+
+
+class RedisResultStore():
+    """
+    Stores results in Redis.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection.
+
+    ttl : int or None, default=None
+        Number of seconds for which results are kept. If `None`, results are 
+        kept until they are deleted.
+
+    compression : str or None, default=None
+        `'zlib'`, `'lz4'`, or `None` for no compression.
+
+    prefix : str, default='flask_worker:result:'
+        Prefix of the Redis keys.
+    """
+    def __init__(
+            self, connection, ttl=None, compression=None, 
+            prefix='flask_worker:result:'
+        ):
+        self.connection = connection
+        self.ttl, self.compression = ttl, compression
+        self.prefix = prefix
+
+    def set(self, job_id, result):
+        """
+        Store a job's result.
+
+        Parameters
+        ----------
+        job_id : str
+
+        result :
+            Picklable result.
+        """
+        self.set_raw(job_id, dumps(result, self.compression))
+
+    def set_raw(self, job_id, data):
+        # store data which is already serialized
+        self.connection.set(self.prefix+job_id, data, ex=self.ttl)
+
+    def get(self, job_id, default=None):
+        """
+        Load a job's result.
+
+        Parameters
+        ----------
+        job_id : str
+
+        default : default=None
+            Returned if the job has no stored result.
+
+        Returns
+        -------
+        result :
+        """
+        data = self.connection.get(self.prefix+job_id)
+        return default if data is None else loads(data)
+
+    def delete(self, job_id):
+        """
+        Delete a job's result.
+
+        Parameters
+        ----------
+        job_id : str
+        """
+        self.connection.delete(self.prefix+job_id)
+
+
+class FileResultStore():
+    """
+    Stores results as files in a local directory. Use this store when the web 
+    and worker processes share a file system.
+
+    Parameters
+    ----------
+    directory : str
+        Directory in which results are stored. It is created if it does not 
+        exist.
+
+    ttl : int or None, default=None
+        Number of seconds for which results are kept. Expired results are 
+        deleted when they are read.
+
+    compression : str or None, default=None
+        `'zlib'`, `'lz4'`, or `None` for no compression.
+    """
+    def __init__(self, directory, ttl=None, compression=None):
+        self.directory = directory
+        self.ttl, self.compression = ttl, compression
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def set(self, job_id, result):
+        """
+        Store a job's result.
+
+        Parameters
+        ----------
+        job_id : str
+
+        result :
+            Picklable result.
+        """
+        self.set_raw(job_id, dumps(result, self.compression))
+
+    def set_raw(self, job_id, data):
+        # write to a temporary file first so readers never see partial data
+        path = self._path(job_id)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id, default=None):
+        """
+        Load a job's result.
+
+        Parameters
+        ----------
+        job_id : str
+
+        default : default=None
+            Returned if the job has no stored result, or its result expired.
+
+        Returns
+        -------
+        result :
+        """
+        path = self._path(job_id)
+        try:
+            if self.ttl is not None and (
+                time.time() - os.path.getmtime(path) > self.ttl
+            ):
+                self.delete(job_id)
+                return default
+            with open(path, 'rb') as f:
+                return loads(f.read())
+        except FileNotFoundError:
+            return default
+
+    def delete(self, job_id):
+        """
+        Delete a job's result.
+
+        Parameters
+        ----------
+        job_id : str
+        """
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
@@ -1,10 +1,12 @@
 """# Routers"""
 
 from flask import current_app
-from sqlalchemy import Column, String
+from sqlalchemy import Column, String, Text, event
 from sqlalchemy.inspection import inspect
+from sqlalchemy.orm import Session
 from sqlalchemy_mutable import MutableType, partial as partial_base
 
+import json
 from functools import wraps
 
 def set_route(func):
@@ -12,22 +14,65 @@ def set_route(func):
     The `@set_route` decorator bookmarks the current function call. 
     Specifically, it sets the Router's `func` to the the current function and 
     stores the args and kwargs.
+
+    Decorated methods are registered as routes which a `JSONRouterMixin` may 
+    bookmark.
     """
     @wraps(func)
     def with_route_setting(router, *args, **kwargs):
-        router.func = partial(func, *args, **kwargs)
+        router._set_route(func, args, kwargs)
         return func(router, *args, **kwargs)
         
+    with_route_setting.is_route = True
     return with_route_setting
 
 
+FLUSHED_KEY = 'flask_worker_flushed'
+
+@event.listens_for(Session, 'after_flush')
+def _mark_flushed(session, flush_context):
+    # the session still holds its pre-flush state
+    if has_pending(session):
+        session.info[FLUSHED_KEY] = True
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _clear_flushed(session):
+    session.info.pop(FLUSHED_KEY, None)
+
+def has_pending(session):
+    """
+    Indicates that the session has pending changes. Objects in 
+    `session.dirty` whose attributes were set to their current values do not 
+    count.
+    """
+    return bool(
+        session.new or session.deleted 
+        or any(session.is_modified(obj) for obj in session.dirty)
+    )
+
+def has_changes(session):
+    """
+    Indicates that the session has pending changes, or flushed changes which 
+    were not committed yet, e.g. by an autoflush.
+    """
+    return bool(session.info.get(FLUSHED_KEY)) or has_pending(session)
+
+
 class partial(partial_base):
     """
     This functions like partial, but instead of storing a function directly,
     it stores the name of a Router method. When called, the router is passed
     as the first argument, allowing partial to look up and execute that 
     method. 
+
+    The unshelled args and kwargs are cached on first use, so calling the 
+    partial repeatedly does not copy them.
     """
+    _untracked_attr_names = (
+        partial_base._untracked_attr_names + ['_unshelled']
+    )
+
     @property
     def name(self):
         return self.func
@@ -37,16 +82,86 @@ class partial(partial_base):
         self.args, self.kwargs = list(args), kwargs
 
     def __call__(self, router, *args, **kwargs):
-        func = getattr(router, self.func)
-        kwargs_ = self.kwargs.unshell()
-        kwargs_.update(kwargs)
-        return func(*args, *self.args.unshell(), **kwargs)
+        args_, kwargs_ = self.unshelled
+        if kwargs:
+            kwargs_ = dict(kwargs_, **kwargs)
+        return getattr(type(router), self.func)(
+            router, *args, *args_, **kwargs_
+        )
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('_unshelled', None)
+        return state
+
+    @property
+    def unshelled(self):
+        """
+        Returns
+        -------
+        args, kwargs : tuple, dict
+            Unshelled args and kwargs.
+        """
+        unshelled = self.__dict__.get('_unshelled')
+        if unshelled is None:
+            unshelled = tuple(self.args.unshell()), self.kwargs.unshell()
+            self._unshelled = unshelled
+        return unshelled
+
+    def matches(self, args, kwargs):
+        """
+        Returns
+        -------
+        matches : bool
+            Indicates that the partial stores these args and kwargs.
+        """
+        args_, kwargs_ = self.unshelled
+        return args_ == tuple(args) and kwargs_ == kwargs
 
     def __repr__(self):
         return '<{}>'.format(self.func)
 
 
-class RouterMixin():
+class RouterBase():
+    """
+    Base class for Routers. Subclasses store the bookmarked function call.
+    """
+    def __call__(self, *args, **kwargs):
+        """
+        Calls `self.func`, passing in `self.args` and `self.kwargs`.
+
+        Parameters
+        ----------
+        \*args, \*\*kwargs :
+            Passed to the current function call.
+
+        Returns
+        -------
+        page_html : str
+            Html of the page returned by the current route.
+        """
+        page_html = self.func(self, *args, **kwargs)
+        session = current_app.extensions['manager'].db.session
+        if not inspect(self).identity:
+            session.add(self)
+        if has_changes(session):
+            # skip the commit when the route did not change anything
+            session.commit()
+        return page_html
+
+    def reset(self):
+        """
+        Reset the series of function calls to its initial state.
+
+        Returns
+        -------
+        self : flask_worker.RouterBase
+        """
+        self.func = None
+        return self
+
+
+class RouterMixin(RouterBase):
     """
     Mixin for Router models. A Router manages a series of function calls 
     initiated by a view function. These function calls must be methods of the 
@@ -93,34 +208,161 @@ class RouterMixin():
         super().__init__()
         self.init_func = partial(func, *args, **kwargs)
 
-    def __call__(self, *args, **kwargs):
-        """
-        Calls `self.func`, passing in `self.args` and `self.kwargs`.
+    def _set_route(self, func, args, kwargs):
+        current = self._func
+        if (
+            current is None or current.name != func.__name__ 
+            or not current.matches(args, kwargs)
+        ):
+            # only re-serialize the bookmark when it changes
+            self.func = partial(func, *args, **kwargs)
 
-        Parameters
-        ----------
-        \*args, \*\*kwargs :
-            Passed to the current function call.
 
-        Returns
-        -------
-        page_html : str
-            Html of the page returned by the current route.
-        """
-        page_html = self.func(self, *args, **kwargs)
-        session = current_app.extensions['manager'].db.session
-        if not inspect(self).identity:
-            session.add(self)
-        session.commit()
-        return page_html
+class Route():
+    """
+    Bookmarked call of a Router method, decoded from a `JSONRouterMixin`'s 
+    columns. Like `partial`, it is called with the router as its first 
+    argument.
+    """
+    def __init__(self, name, args, kwargs):
+        self.name, self.args, self.kwargs = name, args, kwargs
 
-    def reset(self):
-        """
-        Reset the series of function calls to its initial state.
+    def __call__(self, router, *args, **kwargs):
+        kwargs_ = dict(self.kwargs, **kwargs) if kwargs else self.kwargs
+        return getattr(type(router), self.name)(
+            router, *args, *self.args, **kwargs_
+        )
 
-        Returns
-        -------
-        self : flask_worker.RouterMixin
-        """
-        self.func = None
-        return self
\ No newline at end of file
+    def __repr__(self):
+        return '<{}>'.format(self.name)
+
+
+def encode_args(args, kwargs):
+    # compact JSON encoding of a route's args and kwargs
+    return json.dumps([list(args), kwargs], separators=(',', ':'))
+
+
+class JSONRouterMixin(RouterBase):
+    """
+    Mixin for Router models which store their bookmarks compactly. Instead 
+    of pickling a `partial`, the Router stores the name of the bookmarked 
+    method in an indexed string column and its args and kwargs as JSON. 
+    Loading a Router therefore costs one small JSON decode, and Routers can 
+    be queried by their current route.
+
+    Only registered methods may be bookmarked: methods decorated with 
+    `@set_route`, and the names listed in the `routes` class attribute (e.g. 
+    an initial method which does not set the route). Args and kwargs must be 
+    JSON-serializable.
+
+    Parameters
+    ----------
+    func : callable
+        The method executed when the Router is called.
+
+    \*args, \*\*kwargs : 
+        JSON-serializable arguments and keyword arguments passed to `func`.
+
+    Attributes
+    ----------
+    func : flask_worker.router_mixin.Route
+        The bookmarked method call, or the initial call if there is no 
+        bookmark.
+
+    route_name : str or None
+        Name of the bookmarked method.
+
+    route_args : str or None
+        JSON-encoded args and kwargs of the bookmarked method.
+
+    init_route_name : str
+        Name of the initial method.
+
+    init_route_args : str
+        JSON-encoded args and kwargs of the initial method.
+
+    routes : tuple of str, default=()
+        Names of methods which may be bookmarked in addition to those 
+        decorated with `@set_route`.
+
+    Examples
+    --------
+    ```python
+    class Router(JSONRouterMixin, db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        routes = ('func1',)
+
+        def __init__(self):
+            super().__init__(self.func1, 'hello world')
+
+        def func1(self, hello_world):
+            return self.func2('hello moon')
+
+        @set_route
+        def func2(self, hello_moon):
+            ...
+    ```
+    """
+    route_name = Column(String, index=True)
+    route_args = Column(Text)
+    init_route_name = Column(String)
+    init_route_args = Column(Text)
+    routes = ()
+
+    @classmethod
+    def _registered_routes(cls):
+        # names of methods which may be bookmarked, cached per class
+        if '_route_registry' not in cls.__dict__:
+            cls._route_registry = frozenset(cls.routes) | {
+                name for klass in cls.__mro__ 
+                for name, attr in vars(klass).items() 
+                if getattr(attr, 'is_route', False)
+            }
+        return cls._route_registry
+
+    def _check_route(self, name):
+        if name not in self._registered_routes():
+            raise ValueError(
+                '{} is not a registered route of {}'.format(name, type(self))
+            )
+        return name
+
+    @property
+    def func(self):
+        if self.route_name is None:
+            name, encoded = self.init_route_name, self.init_route_args
+        else:
+            name, encoded = self.route_name, self.route_args
+        cache = self.__dict__.get('_route_cache')
+        if cache is None or cache[:2] != (name, encoded):
+            # decode once per bookmark
+            args, kwargs = json.loads(encoded)
+            route = Route(self._check_route(name), args, kwargs)
+            self._route_cache = cache = (name, encoded, route)
+        return cache[2]
+
+    @func.setter
+    def func(self, val):
+        if val is None:
+            self.route_name = self.route_args = None
+        elif isinstance(val, Route):
+            self._bookmark(val.name, val.args, val.kwargs)
+        else:
+            self._set_route(val, (), {})
+
+    def __init__(self, func, *args, **kwargs):
+        super().__init__()
+        self.init_route_name = self._check_route(func.__name__)
+        self.init_route_args = encode_args(args, kwargs)
+
+    def _set_route(self, func, args, kwargs):
+        self._bookmark(func.__name__, args, kwargs)
+
+    def _bookmark(self, name, args, kwargs):
+        self._check_route(name)
+        encoded = encode_args(args, kwargs)
+        # only assign the columns when the bookmark changes
+        if self.route_name != name:
+            self.route_name = name
+        if self.route_args != encoded:
+            self.route_args = encoded
@@ -0,0 +1,117 @@
+"""# Redis queue workers
+
+Redis queue workers which keep the Flask application warm across jobs.
+
+A plain `rq worker` imports the application inside every job. These worker 
+classes locate the application in the worker process before the job is 
+executed. Because `rq.Worker` forks a work horse for each job, the horse 
+inherits the already-imported application and only pushes a fresh 
+application context.
+
+Run them with the `-w` option of the `rq` command line interface:
+
+```
+$ rq worker -w flask_worker.AppWorker my-task-queue
+```
+
+Weighted workers drain several queues in a weighted random order, so a 
+flood of jobs on a low-priority queue does not starve a high-priority one. 
+By default, the queues are weighted by the order in which they are listed; 
+the first of three queues is drained three times as often as the last:
+
+```
+$ rq worker -w flask_worker.WeightedAppWorker interactive bulk background
+```
+"""
+
+from flask_worker.tasks import load_app
+
+import rq
+
+import random
+
+
+def weighted_order(queues, weights):
+    """
+    Order queues by a weighted random draw without replacement. A queue is 
+    first with a probability proportional to its weight.
+
+    Parameters
+    ----------
+    queues : list of rq.Queue
+
+    weights : dict
+        Maps queue names to positive weights. Unlisted queues have weight 1.
+
+    Returns
+    -------
+    queues : list of rq.Queue
+    """
+    return sorted(
+        queues, reverse=True,
+        key=lambda queue: random.random() ** (1./weights.get(queue.name, 1))
+    )
+
+
+class AppWorkerMixin():
+    """
+    Mixin for `rq` worker classes. Before executing a job enqueued by a 
+    Flask-Worker worker, it loads the job's application once per process.
+    """
+    def execute_job(self, job, queue):
+        app_import = (job.kwargs or {}).get('app_import')
+        if app_import is not None:
+            load_app(app_import)
+        return super().execute_job(job, queue)
+
+
+class AppWorker(AppWorkerMixin, rq.Worker):
+    """
+    Forking `rq` worker which preloads the Flask application in the parent 
+    process.
+    """
+    pass
+
+
+class SimpleAppWorker(AppWorkerMixin, rq.SimpleWorker):
+    """
+    Non-forking `rq` worker which loads the Flask application once and 
+    reuses it for every job.
+    """
+    pass
+
+
+class WeightedQueuesMixin():
+    """
+    Mixin for `rq` worker classes. After every job, it reorders the queues 
+    from which the next job is dequeued with `weighted_order`.
+
+    Attributes
+    ----------
+    queue_weights : dict or None, default=None
+        Maps queue names to weights, e.g. the manager's `queue_weights`. If 
+        `None`, the first of `n` queues has weight `n` and the last has 
+        weight 1.
+    """
+    queue_weights = None
+
+    def reorder_queues(self, reference_queue):
+        weights = self.queue_weights or {
+            queue.name: len(self.queues)-i 
+            for i, queue in enumerate(self.queues)
+        }
+        self._ordered_queues = weighted_order(self.queues, weights)
+
+
+class WeightedAppWorker(WeightedQueuesMixin, AppWorker):
+    """
+    Forking `rq` worker which drains its queues in weighted order.
+    """
+    pass
+
+
+class WeightedSimpleAppWorker(WeightedQueuesMixin, SimpleAppWorker):
+    """
+    Non-forking `rq` worker which drains its queues in weighted order.
+    """
+    pass
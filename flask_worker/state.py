@@ -0,0 +1,181 @@
+"""# Worker state
+
+Redis-hosted job state of workers. With the manager's `state_backend` set to
+`'redis'`, a worker's `job_finished`, `job_in_progress`, and `job_id` are
+kept in a Redis hash keyed by its `model_id`, so state transitions and status
+checks never write to the application database. Changed workers are
+recorded in a set, from which their state is written behind to the
+database's columns in batches; see `Manager.flush_worker_states`.
+"""
+
+import json
+import logging
+import threading
+
+FIELDS = ('job_finished', 'job_in_progress', 'job_id')
+
+logger = logging.getLogger(__name__)
+
+
+class RedisWorkerState():
+    """
+    Stores workers' job state in Redis.
+
+    Parameters
+    ----------
+    connection : redis.client.Redis
+        Redis connection.
+
+    ttl : int or None, default=None
+        Number of seconds for which a worker's state is kept after it last
+        changed. Once it expires, the worker's state is read from the
+        database again.
+    """
+    prefix = 'flask_worker:state:'
+    dirty_key = 'flask_worker:state_dirty'
+
+    def __init__(self, connection, ttl=None):
+        self.connection, self.ttl = connection, ttl
+
+    def key(self, model_id):
+        return self.prefix + model_id
+
+    def get(self, model_id, field):
+        """
+        Parameters
+        ----------
+        model_id : str
+            Worker's `model_id`.
+
+        field : str
+            `'job_finished'`, `'job_in_progress'`, or `'job_id'`.
+
+        Returns
+        -------
+        found, value : bool, object
+            Indicator that the field is stored, and its value.
+        """
+        data = self.connection.hget(self.key(model_id), field)
+        if data is None:
+            return False, None
+        return True, json.loads(data)
+
+    def set(self, model_id, field, value):
+        """
+        Set a field of a worker's state and mark the worker for flushing.
+        """
+        key = self.key(model_id)
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.hset(key, field, json.dumps(value))
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.sadd(self.dirty_key, model_id)
+        pipe.execute()
+
+    def get_many(self, model_ids):
+        """
+        Parameters
+        ----------
+        model_ids : list of str
+            Workers' `model_id`s.
+
+        Returns
+        -------
+        states : dict
+            Maps `model_id`s to dictionaries of their stored fields. Workers
+            whose state has expired are omitted.
+        """
+        pipe = self.connection.pipeline(transaction=False)
+        [pipe.hgetall(self.key(model_id)) for model_id in model_ids]
+        states = {}
+        for model_id, data in zip(model_ids, pipe.execute()):
+            if data:
+                states[model_id] = {
+                    field.decode(): json.loads(value)
+                    for field, value in data.items()
+                }
+        return states
+
+    def pop_dirty(self, count=1000):
+        """
+        Returns
+        -------
+        model_ids : list of str
+            Up to `count` workers whose state has changed since it was last
+            flushed. They are removed from the set of changed workers.
+        """
+        return [
+            model_id.decode()
+            for model_id in self.connection.spop(self.dirty_key, count)
+        ]
+
+    def mark_dirty(self, model_ids):
+        # mark workers for flushing again, e.g. after a failed flush
+        if model_ids:
+            self.connection.sadd(self.dirty_key, *model_ids)
+
+
+class StateFlusher(threading.Thread):
+    """
+    Daemon thread which periodically flushes workers' state to the
+    database.
+
+    Parameters
+    ----------
+    app : flask.app.Flask
+        Application whose manager's `flush_worker_states` method is called.
+
+    interval : float
+        Number of seconds between flushes.
+    """
+    def __init__(self, app, interval):
+        super().__init__(daemon=True, name='flask-worker-state-flusher')
+        self.app, self.interval = app, interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    self.app.extensions['manager'].flush_worker_states()
+            except Exception:
+                logger.exception('Failed to flush worker states')
+
+    def stop(self):
+        self.stopped.set()
+
+
+def _state_property(field):
+    # property which reads and writes a field of the worker's state
+    def get(worker):
+        return worker.store.get(worker.model_id, field)[1]
+
+    def set(worker, value):
+        worker.store.set(worker.model_id, field, value)
+
+    return property(get, set)
+
+
+class DetachedWorker():
+    """
+    Stands in for a worker in a job which does not load the application. 
+    Its job state is read from and written to the state store.
+
+    Parameters
+    ----------
+    store : flask_worker.RedisWorkerState
+
+    model_id : str
+        Worker's `model_id`.
+    """
+    job_finished = _state_property('job_finished')
+    job_in_progress = _state_property('job_in_progress')
+    job_id = _state_property('job_id')
+
+    def __init__(self, store, model_id):
+        self.store, self.model_id = store, model_id
+
+    def reset(self):
+        self.job_finished, self.job_in_progress = False, False
+        self.job_id = None
+        return self
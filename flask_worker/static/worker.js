@@ -0,0 +1,172 @@
+// Flask-Worker loading page script
+//
+// Configured by the data attributes of its script tag. It listens for the 
+// worker's job notifications and navigates to the worker's callback when the 
+// job is finished.
+(function() {
+    var config = document.currentScript.dataset;
+    var job_status_url = (
+        config.statusUrl + "?job_id=" + encodeURIComponent(config.jobId)
+    );
+    var started = false;
+    var position_timer = null;
+
+    function show_progress(progress) {
+        // custom templates may include a #worker-progress element
+        console.log("Progress", progress.fraction, progress.message);
+        var el = document.getElementById("worker-progress");
+        if (el) {
+            el.textContent = (
+                Math.round(100*progress.fraction) + "% "
+                + (progress.message || "")
+            );
+        }
+    }
+
+    function show_position(status) {
+        // custom templates may include a #worker-position element
+        var el = document.getElementById("worker-position");
+        if (!el) {
+            return;
+        }
+        if (started || status.position == null) {
+            el.textContent = "";
+            return;
+        }
+        el.textContent = "Position in queue: " + (status.position + 1);
+        if (status.estimated_wait != null) {
+            el.textContent += (
+                " (about " + Math.ceil(status.estimated_wait) + " s)"
+            );
+        }
+    }
+
+    function check_status(on_finished) {
+        // the response includes the job's queue position while it is queued
+        fetch(job_status_url).then(function(response) {
+            return response.json();
+        }).then(function(status) {
+            if (status.job_finished) {
+                on_finished();
+                return;
+            }
+            show_position(status);
+            if (status.position != null && !started) {
+                clearTimeout(position_timer);
+                position_timer = setTimeout(function() {
+                    check_status(on_finished);
+                }, 1000*parseFloat(config.positionInterval || 5));
+            }
+        });
+    }
+
+    function job_started() {
+        console.log("Job started");
+        started = true;
+        show_position({});
+    }
+
+    function job_finished() {
+        console.log("Job finished");
+        if (config.callbackBeaconUrl) {
+            navigator.sendBeacon(
+                config.callbackBeaconUrl + "?job_id="
+                + encodeURIComponent(config.jobId)
+            );
+        }
+        window.location.replace(config.callback);
+    }
+
+    function job_cancelled() {
+        // the job was abandoned; reloading the page enqueues it again
+        console.log("Job cancelled");
+        window.location.reload();
+    }
+
+    function job_failed() {
+        // the job failed for good; custom templates may include a 
+        // #worker-error element
+        console.log("Job failed");
+        var el = document.getElementById("worker-error");
+        if (!el) {
+            el = document.createElement("p");
+            document.body.appendChild(el);
+        }
+        el.textContent = "The job failed. Reload the page to try again.";
+    }
+
+    function listen_sse() {
+        var events = new EventSource(
+            config.eventsUrl
+            + "?model_id=" + encodeURIComponent(config.modelId)
+            + "&job_id=" + encodeURIComponent(config.jobId)
+        );
+        events.addEventListener("job_started", job_started);
+        events.addEventListener("progress", function(e) {
+            show_progress(JSON.parse(e.data));
+        });
+        events.addEventListener("job_finished", function() {
+            events.close();
+            job_finished();
+        });
+        events.addEventListener("job_cancelled", function() {
+            events.close();
+            job_cancelled();
+        });
+        events.addEventListener("job_failed", function() {
+            events.close();
+            job_failed();
+        });
+        // the event stream reports a finished job itself
+        check_status(function() {});
+    }
+
+    function listen_socketio() {
+        var model_id = config.modelId;
+        var socket = io.connect(window.location.origin + config.namespace);
+        socket.on("connect", function() {
+            console.log("Socket connected");
+            socket.emit("join", [model_id], function() {
+                // the job may have finished before the socket connected
+                check_status(job_finished);
+            });
+        });
+        socket.on("job_started", function(e) {
+            if (e.model_id == model_id) {
+                job_started();
+            }
+        });
+        socket.on("progress", function(e) {
+            if (e.model_id == model_id) {
+                show_progress(e.data);
+            }
+        });
+        socket.on("job_finished", function(e) {
+            if (e.model_id == model_id) {
+                job_finished();
+            }
+        });
+        socket.on("job_cancelled", function(e) {
+            if (e.model_id == model_id) {
+                job_cancelled();
+            }
+        });
+        socket.on("job_failed", function(e) {
+            if (e.model_id == model_id) {
+                job_failed();
+            }
+        });
+        if (config.heartbeat) {
+            // tell the server that a client is still on the loading page
+            setInterval(function() {
+                socket.emit("heartbeat", [model_id]);
+            }, 1000*parseFloat(config.heartbeat));
+        }
+    }
+
+    if (config.transport == "sse") {
+        listen_sse();
+    } else {
+        listen_socketio();
+    }
+})();
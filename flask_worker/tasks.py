@@ -3,59 +3,743 @@
 This function is used by a Worker to execute its job (i.e. its 
 Employer's complex task).
 
-The worker's script connects a socket which listens for a 'job_finished' 
-emission on a dedicated namespace for the worker (specified by the worker's 
-`model_id`). When the socket hears the 'job_finished' emission, it replaces 
-the worker's loading page with a request to the worker's `callback` view 
-function.
+The worker's script connects a socket to the manager's namespace and joins 
+the room for the worker (specified by the worker's `model_id`). It then 
+listens for a 'job_finished' emission to that room. When the socket hears 
+the 'job_finished' emission, it replaces the worker's loading page with a 
+request to the worker's `callback` view function.
+
+The Flask application is located once per process and reused across jobs 
+(see `load_app`). Each job pushes its own application context and removes 
+its database session when it ends, so jobs never share session state.
+
+Detached function jobs (see the manager's `detached_jobs` setting) do not 
+load the application at all. They build a manager from the settings passed 
+with the job, keep the worker's job state in Redis, and notify clients 
+through the message queue.
 """
 
+from flask_worker.chains import ChainState
+from flask_worker.maps import MapState, is_map_id
+from flask_worker.metrics import job_name
+from flask_worker.emitter import get_connection
+from flask_worker.recovery import Heartbeat, Reaper
+from flask_worker.state import DetachedWorker
+
 from pydoc import locate
+from rq import get_current_job
+from sqlalchemy.inspection import inspect as inspect_model
+from sqlalchemy.orm import aliased, selectinload
+import asyncio
+import datetime
+import functools
+import inspect
+import json
 import os
 import sys
+import threading
+import time
+
+# Flask applications which have already been located, keyed by import path
+_apps = {}
+# managers of detached jobs, keyed by their settings
+_detached_managers = {}
+# holds the job manager and job running in the current thread
+_local = threading.local()
+
+def load_app(app_import):
+    """
+    Locate the Flask application at `app_import`. The application is 
+    imported the first time it is requested and cached for the lifetime of 
+    the process.
+
+    Parameters
+    ----------
+    app_import : str
+        Pythonic import path for the Flask application.
+
+    Returns
+    -------
+    app : flask.app.Flask
+    """
+    if app_import not in _apps:
+        sys.path.insert(0, os.getcwd())
+        try:
+            _apps[app_import] = locate(app_import)
+        finally:
+            sys.path.pop(0)
+    return _apps[app_import]
+
+def detached_manager(settings):
+    """
+    Build the manager of a detached job from the settings of the web 
+    application's manager. The manager stores states, results and claims on 
+    the Redis server of the application's connection, and notifies clients 
+    through the message queue. Managers are cached per process, and share 
+    one Redis connection pool per server.
+
+    Parameters
+    ----------
+    settings : dict
+        See `Manager.job_settings`.
+
+    Returns
+    -------
+    manager : flask_worker.Manager
+    """
+    # settings may hold dicts, e.g. queue_limits
+    key = json.dumps(settings, sort_keys=True)
+    if key not in _detached_managers:
+        from flask_worker import Manager
+
+        settings = dict(settings)
+        url = settings.pop('connection_url')
+        _detached_managers[key] = Manager(
+            connection=get_connection(url), state_flush_interval=None, 
+            **settings
+        )
+    return _detached_managers[key]
+
+def current_job():
+    """
+    Returns
+    -------
+    job : rq.job.Job, flask_worker.executors.LocalJob, or None
+        Job running in the current thread, if any.
+    """
+    return getattr(_local, 'job', None) or get_current_job()
+
+def task(steps):
+    """
+    Make a task from a generator function, its steps. The steps yield the 
+    awaitables returned by coroutine functions and methods, and receive 
+    their results. The task awaits them on a new event loop. The asyncio 
+    executor runs the steps with `run_task_async` instead.
+    """
+    @functools.wraps(steps)
+    def run_task(*args, **kwargs):
+        return run_steps(steps(*args, **kwargs))
+
+    run_task.steps = steps
+    return run_task
+
+def advance(steps, value=None, error=None):
+    """
+    Run a task's steps until they yield an awaitable or return.
+
+    Returns
+    -------
+    done, value : bool, object
+        Whether the steps returned, and their return value or the awaitable 
+        they yielded.
+    """
+    try:
+        if error is not None:
+            return False, steps.throw(error)
+        return False, steps.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+def awaited(result):
+    # steps which await a result, if it is awaitable
+    if inspect.isawaitable(result):
+        result = yield result
+    return result
+
+def run_steps(steps):
+    # run a task's steps in this thread, awaiting on a new event loop
+    done, value = advance(steps)
+    while not done:
+        loop = asyncio.new_event_loop()
+        try:
+            value, error = loop.run_until_complete(value), None
+        except Exception as exc:
+            value, error = None, exc
+        finally:
+            loop.close()
+        done, value = advance(steps, value, error)
+    return value
+
+async def run_task_async(run_task, kwargs, job=None, executor=None):
+    """
+    Run a task on the running event loop. The synchronous parts of its steps 
+    run in the `executor`, and the awaitables they yield are awaited on the 
+    loop, so a job does not hold a thread while it awaits.
+
+    Parameters
+    ----------
+    run_task : callable
+        Task made with `task`.
+
+    kwargs : dict
+        Keyword arguments passed to the task.
+
+    job : flask_worker.executors.LocalJob or None, default=None
+        Job returned by `current_job` while the steps run.
+
+    executor : concurrent.futures.Executor or None, default=None
+        Executor of the synchronous parts. A single thread keeps the job's 
+        database connection on one thread, as SQLite requires. If `None`, 
+        the loop's default executor is used.
+
+    Returns
+    -------
+    result :
+        Value returned by the task.
+    """
+    loop = asyncio.get_running_loop()
+    steps = run_task.steps(**kwargs)
+    state = dict(value=None, error=None, job_manager=None)
+    while True:
+        done, value, state['job_manager'] = await loop.run_in_executor(
+            executor, functools.partial(_advance_thread, steps, job, **state)
+        )
+        if done:
+            return value
+        try:
+            state['value'], state['error'] = await value, None
+        except Exception as error:
+            state['value'], state['error'] = None, error
+
+def _advance_thread(steps, job, value, error, job_manager):
+    # advance a task's steps in an executor thread; the job is suspended 
+    # from the thread while its awaitable is awaited, so the thread can run 
+    # other jobs' steps, and resumed before its steps continue
+    _local.job = job
+    try:
+        if job_manager is not None:
+            job_manager.resume()
+        done, value = advance(steps, value, error)
+        job_manager = getattr(_local, 'job_manager', None)
+        if not done and job_manager is not None:
+            job_manager.suspend()
+        return done, value, job_manager
+    finally:
+        _local.job = None
+
+def report_progress(fraction, message=None):
+    """
+    Report the progress of the current job. Call this from inside a function 
+    or method executed by a worker.
+
+    Reports are rate-limited to the manager's `progress_rate`. Reports made 
+    in between are coalesced; only the latest is sent, once the interval has 
+    elapsed. A report of a `fraction` of 1 or more is always sent at once. 
+    The latest report is also written to the job's meta, where the job 
+    status endpoints can read it.
+
+    Outside of a job, this function does nothing.
+
+    Parameters
+    ----------
+    fraction : float
+        Fraction of the job completed, between 0 and 1.
+
+    message : str or None, default=None
+        Optional progress message.
+
+    Examples
+    --------
+    ```python
+    from flask_worker import report_progress
+
+    def complex_task(seconds):
+        for i in range(seconds):
+            report_progress(i/seconds, 'Working...')
+            time.sleep(1)
+        return 'Hello, World!'
+    ```
+    """
+    job_manager = getattr(_local, 'job_manager', None)
+    if job_manager is not None:
+        job_manager.report_progress(fraction, message)
+
+def loader_options(model_cls, relationships):
+    """
+    Parameters
+    ----------
+    model_cls : class
+        Database model class.
 
+    relationships : iterable of str
+        Names of the model's relationships, with nested relationships 
+        separated by dots.
+
+    Returns
+    -------
+    options : list of sqlalchemy.orm.Load
+        Options which eagerly load the relationships with a `SELECT ... IN` 
+        query each.
+    """
+    options = []
+    for path in relationships:
+        cls, option = model_cls, None
+        for name in path.split('.'):
+            attr = getattr(cls, name)
+            option = (
+                selectinload(attr) if option is None 
+                else option.selectinload(attr)
+            )
+            cls = inspect_model(cls).mapper.relationships[name].mapper.class_
+        options.append(option)
+    return options
+
+class JobCancelled(Exception):
+    """
+    Raised by `check_cancelled` when the current job was cancelled.
+    """
+
+
+def check_cancelled():
+    """
+    Check whether the current job was cancelled, either explicitly with 
+    `Manager.cancel_job` or because its worker was abandoned (see the 
+    manager's `abandon_after` setting). Long-running functions and methods 
+    call this periodically to stop early. Checks are rate-limited to one per 
+    `cancel_check_interval` seconds.
+
+    A cancelled job is not finished. The worker's job state is reset, so 
+    the job is enqueued again when a client next visits the worker's page.
+
+    Outside of a job, this function does nothing.
+
+    Raises
+    ------
+    flask_worker.JobCancelled
+        If the current job was cancelled.
+
+    Examples
+    --------
+    ```python
+    from flask_worker import check_cancelled
+
+    def complex_task(seconds):
+        for i in range(seconds):
+            check_cancelled()
+            time.sleep(1)
+        return 'Hello, World!'
+    ```
+    """
+    job_manager = getattr(_local, 'job_manager', None)
+    if job_manager is not None:
+        job_manager.check_cancelled()
+
+@task
 def execute_method(
     app_import, worker_cls, worker_id,
-    model_cls, model_id, method_name, args, kwargs, 
+    model_cls, model_id, method_name, args, kwargs, eager_load=()
 ):
     """
     Execute a database model's method. See `execute_method` in 
-    `worker_mixin.py` for parameter details.
+    `worker_mixin.py` for parameter details. The model is loaded together 
+    with the worker, and `eager_load` names the relationships of the model 
+    to load eagerly.
     """
-    manager = JobManager().prepare_job(app_import, worker_cls, worker_id)
-    model = model_cls.query.get(model_id)
-    result = getattr(model, method_name)(*args, **kwargs)
-    manager.finish_job()
+    manager = JobManager().prepare_job(
+        app_import, worker_cls, worker_id, 
+        name=job_name(model_cls=model_cls, method_name=method_name),
+        model_cls=model_cls, model_id=model_id, eager_load=eager_load
+    )
+    try:
+        manager.check_cancelled(force=True)
+        method = getattr(manager.model, method_name)
+        result = yield from awaited(method(*args, **kwargs))
+        result = manager.finish_job(result)
+    except JobCancelled:
+        result = manager.cancel_job()
+    finally:
+        manager.teardown_job()
     return result
 
-def execute_func(app_import, worker_cls, worker_id, func, args, kwargs):
+@task
+def execute_func(
+    app_import, worker_cls, worker_id, func, args, kwargs, memo_key=None
+):
     """
     Execute a function. See `execute_function` in `worker_mixin.py` for 
-    parameter details.
+    parameter details. If `memo_key` is given, the result is stored in the 
+    manager's memoization cache under that key.
+    """
+    manager = JobManager().prepare_job(
+        app_import, worker_cls, worker_id, name=job_name(func)
+    )
+    return (yield from run_func(manager, func, args, kwargs, memo_key))
+
+@task
+def execute_detached_func(
+    settings, model_id, func, args, kwargs, memo_key=None
+):
     """
-    manager = JobManager().prepare_job(app_import, worker_cls, worker_id)
-    result = func(*args, **kwargs)
-    manager.finish_job()
+    Execute a function without loading the application. The job's manager 
+    is built from the web application manager's `settings`, and the job 
+    state of the worker with `model_id` is kept in Redis. See the manager's 
+    `detached_jobs` setting.
+    """
+    manager = JobManager().prepare_detached_job(
+        settings, model_id, name=job_name(func)
+    )
+    return (yield from run_func(manager, func, args, kwargs, memo_key))
+
+def run_func(manager, func, args, kwargs, memo_key=None):
+    # steps which run a function in a prepared job
+    try:
+        manager.check_cancelled(force=True)
+        result = yield from awaited(func(*args, **kwargs))
+        if memo_key is not None:
+            manager.manager.memo.set(memo_key, result)
+        result = manager.finish_job(result)
+    except JobCancelled:
+        result = manager.cancel_job()
+    finally:
+        manager.teardown_job()
     return result
 
+@task
+def execute_chunk(
+    app_import, worker_cls, worker_id, map_id, index, func, chunk, 
+    reduce=None
+):
+    """
+    Execute a chunk of a map job. See `enqueue_map` in `worker_mixin.py` for 
+    parameter details. The job which completes the last chunk runs the 
+    reducer and finishes the worker.
+    """
+    manager = JobManager().prepare_job(
+        app_import, worker_cls, worker_id, job_id=map_id, notify=False, 
+        name=job_name(func)
+    )
+    try:
+        state = MapState(
+            manager.manager.connection, map_id, manager.manager.result_ttl
+        )
+        if state.failed():
+            # another chunk failed or was cancelled; skip this one
+            manager.finished = True
+            return None
+        try:
+            manager.check_cancelled(force=True)
+            if state.start():
+                manager.manager.notify(manager.model_id, 'job_started')
+            results = []
+            for item in chunk:
+                results.append((yield from awaited(func(item))))
+            done, total = state.finish_chunk(index, results)
+            if done < total:
+                progress = dict(fraction=done/total, message=None)
+                manager.manager.notify(manager.model_id, 'progress', progress)
+                # this chunk is done, though the map job is not
+                manager.finished = True
+                return None
+            result = state.collect()
+            if reduce is not None:
+                result = yield from awaited(reduce(result))
+            state.finish(result)
+        except Exception:
+            state.fail()
+            raise
+        manager.finish_job(result)
+    except JobCancelled:
+        manager.cancel_job()
+    finally:
+        manager.teardown_job()
+
+
+@task
+def execute_step(
+    app_import, worker_cls, worker_id, chain, index, after, func, args, 
+    kwargs
+):
+    """
+    Execute a step of a job chain. See `enqueue_chain` in `worker_mixin.py` 
+    for parameter details. The step receives the results of the steps it 
+    runs `after`. The last step finishes the worker.
+    """
+    manager = JobManager().prepare_job(
+        app_import, worker_cls, worker_id, notify=index == 0, 
+        name=job_name(func)
+    )
+    state = ChainState(
+        manager.manager.connection, chain, manager.manager.result_ttl, 
+        manager.manager.result_compression
+    )
+    try:
+        try:
+            if manager.manager.job_cancelled(chain[-1], manager.model_id):
+                # the worker's job is the last step
+                raise JobCancelled(chain[-1])
+            manager.check_cancelled(force=True)
+            result = yield from awaited(
+                func(*state.results(after), *args, **kwargs)
+            )
+        except Exception:
+            state.abort()
+            raise
+        if index < len(chain)-1:
+            state.set(index, result)
+            # this step is done, though the chain is not
+            manager.finished = True
+            return None
+        state.clear()
+        return manager.finish_job(result)
+    except JobCancelled:
+        return manager.cancel_job()
+    finally:
+        manager.teardown_job()
+
 
 class JobManager():
-    def prepare_job(self, app_import, worker_cls, worker_id):
-        # push the app context
-        sys.path.insert(0, os.getcwd())
-        app = locate(app_import)
-        sys.path.pop(0)
-        app.app_context().push()
-        # get db and socketio
-        manager = app.extensions['manager']
-        self.db, self.socketio = manager.db, manager.socketio
-        self.worker = worker_cls.query.get(worker_id)
-        self.namespace = '/'+self.worker.model_id
-        self.socketio.emit('job_started', namespace=self.namespace)
+    def prepare_job(
+        self, app_import, worker_cls, worker_id, job_id=None, notify=True, 
+        name=None, model_cls=None, model_id=None, eager_load=()
+    ):
+        self._start(name)
+        # push a fresh app context on the (cached) app
+        app = load_app(app_import)
+        self.app_context = app.app_context()
+        self.app_context.push()
+        # get db and notification transport
+        self.manager = app.extensions['manager']
+        self.db = self.manager.db
+        try:
+            self.worker, self.model = self.load_models(
+                worker_cls, worker_id, model_cls, model_id, eager_load
+            )
+            self._attach(job_id)
+        except Exception:
+            # the job cannot start; release its session and app context
+            self.teardown_job()
+            raise
+        return self._begin(notify)
+
+    def prepare_detached_job(self, settings, model_id, name=None):
+        # prepare a job which does not load the application
+        self._start(name)
+        self.app_context, self.db = None, None
+        self.manager = detached_manager(settings)
+        self.worker = DetachedWorker(self.manager.state_store, model_id)
+        self.model = None
+        try:
+            self._attach()
+        except Exception:
+            self.teardown_job()
+            raise
+        return self._begin()
+
+    def _start(self, name):
+        self.name, self.finished = name, False
+        self._started = time.perf_counter()
+        self._cancel_checked = 0
+        self.progress, self._progress_sent = None, 0
+        self._progress_timer = None
+        self._progress_lock = threading.Lock()
+        self.heartbeat = None
+        _local.job_manager = self
+
+    def _attach(self, job_id=None):
+        # attach the job to its worker and start its heartbeat
+        self.model_id = self.worker.model_id
+        self.job_id = job_id or current_job().id
+        if self.manager.heartbeat_interval and not is_map_id(self.job_id):
+            self.heartbeat = Heartbeat(
+                self.manager.connection, self.job_id, 
+                self.manager.heartbeat_interval
+            )
+            self.heartbeat.beat()
+            self.heartbeat.start()
+
+    def _begin(self, notify=True):
+        if notify:
+            self.manager.notify(self.model_id, 'job_started')
+        self._prepared = time.perf_counter()
         return self
 
-    def finish_job(self):
+    def suspend(self):
+        # detach the job from this thread while an awaitable is awaited; its 
+        # session is set aside and its app context popped until it resumes
+        _local.job_manager = None
+        if self.db is not None:
+            self.session = self.db.session()
+            self.db.session.registry.clear()
+        if self.app_context is not None:
+            self.app_context.pop()
+
+    def resume(self):
+        _local.job_manager = self
+        if self.app_context is not None:
+            self.app_context = self.app_context.app.app_context()
+            self.app_context.push()
+        if self.db is not None:
+            self.db.session.registry.set(self.session)
+
+    def load_models(
+        self, worker_cls, worker_id, model_cls=None, model_id=None, 
+        eager_load=()
+    ):
+        # load the worker and the job's model in one query
+        if model_cls is None:
+            return worker_cls.query.get(worker_id), None
+        options = loader_options(model_cls, eager_load)
+        if model_cls is worker_cls and model_id == worker_id:
+            worker = worker_cls.query.options(*options).get(worker_id)
+            return worker, worker
+        if model_cls is worker_cls:
+            # e.g. a worker running a method of another row of its table
+            model_cls = aliased(model_cls)
+            options = loader_options(model_cls, eager_load)
+        worker_key = inspect_model(worker_cls).primary_key[0]
+        mapper = inspect_model(model_cls).mapper
+        # the primary key attribute of the model class or its alias
+        model_key = getattr(
+            model_cls, 
+            mapper.get_property_by_column(mapper.primary_key[0]).key
+        )
+        row = self.db.session.query(worker_cls, model_cls).filter(
+            worker_key == worker_id, model_key == model_id
+        ).options(*options).first()
+        if row is None:
+            # the model does not exist
+            return worker_cls.query.get(worker_id), None
+        return row
+
+    def finish_job(self, result=None):
+        # returns the result to hand back to the Redis queue
+        finishing = time.perf_counter()
+        self._stop_progress()
+        store = self.manager.result_store
+        if store is not None:
+            store.set(self.job_id, result)
+            result = None
+        self.manager.release_job(self.job_id)
+        if self.manager.connection is not None:
+            # the worker's earlier recoveries no longer count against it
+            self.manager.connection.delete(
+                Reaper.retries_prefix+self.model_id
+            )
         self.worker.job_finished, self.worker.job_in_progress = True, False
-        self.db.session.commit()
-        self.socketio.emit('job_finished', namespace=self.namespace)
-        return self
\ No newline at end of file
+        if self.db is not None:
+            self.db.session.commit()
+        self.manager.notify(self.model_id, 'job_finished')
+        self.finished = True
+        if self.manager.metrics is not None:
+            self.record_timings(finishing)
+        return result
+
+    def record_timings(self, finishing):
+        # time each phase of the job and record them
+        now = time.perf_counter()
+        timings = dict(
+            prepare=self._prepared-self._started,
+            execute=finishing-self._prepared,
+            finish=now-finishing
+        )
+        job = current_job()
+        enqueued_at = getattr(job, 'enqueued_at', None)
+        if enqueued_at is not None:
+            utcnow = (
+                datetime.datetime.now(enqueued_at.tzinfo) 
+                if enqueued_at.tzinfo else datetime.datetime.utcnow()
+            )
+            timings['queue_wait'] = max(
+                (utcnow-enqueued_at).total_seconds()-(now-self._started), 0
+            )
+            timings['total'] = timings['queue_wait'] + now-self._started
+        if job is not None:
+            job.meta['timings'] = timings
+            job.save_meta()
+        self.manager.metrics.record_job(
+            self.job_id, self.name, timings, getattr(job, 'origin', None)
+        )
+        self.manager.metrics.mark_finished(self.job_id)
+
+    def check_cancelled(self, force=False):
+        # raise JobCancelled if the job was cancelled or abandoned
+        now = time.monotonic()
+        if (
+            not force 
+            and now - self._cancel_checked < self.manager.cancel_check_interval
+        ):
+            return self
+        self._cancel_checked = now
+        if self.manager.job_cancelled(self.job_id, self.model_id):
+            raise JobCancelled(self.job_id)
+        return self
+
+    def cancel_job(self):
+        # reset the worker, so its job is enqueued again on the next visit
+        self._stop_progress()
+        if self.db is not None:
+            self.db.session.rollback()
+        self.manager.release_job(self.job_id)
+        self.worker.reset()
+        if self.db is not None:
+            self.db.session.commit()
+        self.manager.notify(self.model_id, 'job_cancelled')
+        self.finished = True
+        if self.manager.metrics is not None:
+            self.manager.metrics.count('cancelled', self.name)
+        return None
+
+    def report_progress(self, fraction, message=None):
+        with self._progress_lock:
+            self.progress = dict(fraction=fraction, message=message)
+            wait = (
+                self._progress_sent + 1./self.manager.progress_rate 
+                - time.monotonic()
+            )
+            if fraction < 1 and wait > 0:
+                # coalesce with the reports made until the interval elapses
+                if self._progress_timer is None:
+                    self._progress_timer = threading.Timer(
+                        wait, self._flush_progress, (current_job(),)
+                    )
+                    self._progress_timer.daemon = True
+                    self._progress_timer.start()
+                return self
+            self._stop_progress_timer()
+            self._send_progress(current_job())
+        return self
+
+    def _flush_progress(self, job):
+        # send the latest coalesced report, unless it was already sent or 
+        # the job ended
+        with self._progress_lock:
+            if self._progress_timer is None:
+                return
+            self._progress_timer = None
+            self._send_progress(job)
+
+    def _send_progress(self, job):
+        self._progress_sent = time.monotonic()
+        if job is not None:
+            job.meta['progress'] = self.progress
+            job.save_meta()
+        self.manager.notify(self.model_id, 'progress', self.progress)
+
+    def _stop_progress_timer(self):
+        if self._progress_timer is not None:
+            self._progress_timer.cancel()
+            self._progress_timer = None
+
+    def _stop_progress(self):
+        # drop a pending report; it must not arrive after the job ends
+        with self._progress_lock:
+            self._stop_progress_timer()
+
+    def teardown_job(self):
+        # give the next job a clean scoped session and pop the app context
+        _local.job_manager = None
+        self._stop_progress()
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+        if not self.finished:
+            if self.manager.metrics is not None:
+                self.manager.metrics.count('failed', self.name)
+            if getattr(self, 'job_id', None) is not None:
+                # a failed job is no longer in flight, and an identical job 
+                # may be enqueued again
+                self.manager.release_job(self.job_id)
+        if self.db is not None:
+            self.db.session.remove()
+        if self.app_context is not None:
+            self.app_context.pop()
+        return self
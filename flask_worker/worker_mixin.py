@@ -1,28 +1,61 @@
 """# Workers"""
 
-from flask import current_app, render_template, request
+from flask_worker.admission import Overloaded
+
+from flask import current_app, redirect, request
 from sqlalchemy import Boolean, Column, String
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.inspection import inspect
 from sqlalchemy_modelid import ModelIdBase
 from sqlalchemy_mutable import MutableType
 
+from functools import wraps
+
+
+def eager_load(*relationships):
+    """
+    The `@eager_load` decorator declares the relationships of a model which 
+    a method needs. When the method is enqueued with 
+    `WorkerMixin.enqueue_method`, the job loads the model together with its 
+    worker and eagerly loads these relationships, instead of lazy-loading 
+    them inside the method.
+
+    Parameters
+    ----------
+    \*relationships : str
+        Names of relationships. Nested relationships are separated by dots, 
+        e.g. `'comments.author'`.
+
+    Examples
+    --------
+    ```python
+    class Post(db.Model):
+        ...
+
+        @eager_load('comments', 'comments.author')
+        def summarize(self):
+            ...
+    ```
+    """
+    def add_eager_load(func):
+        func.eager_load = relationships
+        return func
+
+    return add_eager_load
+
 
 def enqueue(enqueue_method):
     # wraps the worker's enqueueing methods
-    def enqueue_wrapper(worker, *args, **kwargs):
-        if inspect(worker).identity is None:
-            # ensure the worker has an id
-            session = worker.manager.db.session
-            session.add(worker)
-            session.commit()
-        if not worker.job_in_progress:
-            # avoid repeat enqueuing
-            job = enqueue_method(worker, *args, **kwargs)
-            worker.job_finished, worker.job_in_progress = False, True
-            worker.job_id = job.get_id()
-            worker.manager.db.session.commit()
-        # return the loading page HTML
-        return render_template(worker.template, worker=worker)
+    # the wrapped method returns the path of the task and its kwargs
+    @wraps(enqueue_method)
+    def enqueue_wrapper(worker, *args, job_queue=None, **kwargs):
+        def enqueue_job():
+            f, job_kwargs = enqueue_method(worker, *args, **kwargs)
+            worker.manager.enqueue_job(
+                worker, f, job_kwargs, queue=job_queue or worker.job_queue
+            )
+
+        return worker._enqueue_once(enqueue_job)
 
     return enqueue_wrapper
 
@@ -74,13 +107,33 @@ class WorkerMixin(ModelIdBase):
 
     job_id : str
         Identifier for the worker's job.
+
+    job_queue : str or None, default=None
+        Name of the queue on which the worker's jobs are enqueued, e.g. a 
+        priority class of the manager's `queue_weights`. Set it on a 
+        subclass, or pass `job_queue` to an `enqueue_*` method to override 
+        it for one job. If `None`, jobs are enqueued on the app's task 
+        queue.
+
+    The job state attributes, `job_finished`, `job_in_progress`, and 
+    `job_id`, are read from and written to Redis if the manager's 
+    `state_backend` is `'redis'`. Their database columns are updated when 
+    the state is flushed. Queries such as 
+    `Worker.query.filter_by(job_finished=True)` use the columns.
+
+    result : 
+        Result of the worker's job, or `None` if the job has not finished. 
+        The result is loaded from the manager's `result_store` (or from its 
+        executor if there is no result store) the first time it is 
+        accessed, so checking `job_finished` never loads it.
     """
     _callback = Column(String)
-    job_finished = Column(Boolean, default=False)
-    job_in_progress = Column(Boolean, default=False)
-    job_id = Column(String)
+    _job_finished = Column('job_finished', Boolean, default=False)
+    _job_in_progress = Column('job_in_progress', Boolean, default=False)
+    _job_id = Column('job_id', String)
     template = Column(String)
     loading_img_src = Column(String)
+    job_queue = None
 
     @property
     def callback(self):
@@ -101,6 +154,74 @@ class WorkerMixin(ModelIdBase):
     def manager(self):
         return current_app.extensions['manager']
 
+    @hybrid_property
+    def job_finished(self):
+        return self._get_state('job_finished')
+
+    @job_finished.setter
+    def job_finished(self, val):
+        self._set_state('job_finished', val)
+
+    @job_finished.expression
+    def job_finished(cls):
+        return cls._job_finished
+
+    @hybrid_property
+    def job_in_progress(self):
+        return self._get_state('job_in_progress')
+
+    @job_in_progress.setter
+    def job_in_progress(self, val):
+        self._set_state('job_in_progress', val)
+
+    @job_in_progress.expression
+    def job_in_progress(cls):
+        return cls._job_in_progress
+
+    @hybrid_property
+    def job_id(self):
+        return self._get_state('job_id')
+
+    @job_id.setter
+    def job_id(self, val):
+        self._set_state('job_id', val)
+
+    @job_id.expression
+    def job_id(cls):
+        return cls._job_id
+
+    def _state_store(self):
+        # the manager's state store, if the worker's state is kept in it
+        if inspect(self).identity is None:
+            # the worker has no model_id yet
+            return None
+        return self.manager.state_store
+
+    def _get_state(self, field):
+        store = self._state_store()
+        if store is not None:
+            found, value = store.get(self.model_id, field)
+            if found:
+                return value
+        return getattr(self, '_'+field)
+
+    def _set_state(self, field, val):
+        store = self._state_store()
+        if store is None:
+            setattr(self, '_'+field, val)
+        else:
+            store.set(self.model_id, field, val)
+
+    @property
+    def result(self):
+        if not self.job_finished or self.job_id is None:
+            return None
+        cache = getattr(self, '_result_cache', None)
+        if cache is None or cache[0] != self.job_id:
+            result = self.manager.job_result(self.job_id)
+            self._result_cache = cache = (self.job_id, result)
+        return cache[1]
+
     def __init__(self, callback=None, template=None, loading_img_src=None):
         self.callback = callback
         self.template = template or self.manager.template
@@ -121,7 +242,9 @@ class WorkerMixin(ModelIdBase):
         return self
 
     @enqueue
-    def enqueue_method(self, model, method_name, *args, **kwargs):
+    def enqueue_method(
+        self, model, method_name, *args, eager_load=None, **kwargs
+    ):
         """
         Enqueue a database model's method for execution.
 
@@ -136,21 +259,35 @@ class WorkerMixin(ModelIdBase):
         \*args, \*\*kwargs :
             Arguments and keyword arguments passed to the method.
 
+        eager_load : tuple of str or None, default=None
+            Relationships of the model which are eagerly loaded when the job 
+            loads it. If `None`, the relationships declared with the 
+            `@eager_load` decorator on the method are used.
+
+        job_queue : str or None, default=None
+            Name of the queue on which the job is enqueued. If `None`, the 
+            worker's `job_queue` is used.
+
         Returns
         -------
         loading_page : str (html)
             The client's loading page.
         """
-        return current_app.task_queue.enqueue(
-            'flask_worker.tasks.execute_method',
-            kwargs=dict(
-                app_import=self.manager.app_import,
-                worker_cls=self.__class__, 
-                worker_id=inspect(self).identity[0],
-                model_cls=type(model),
-                model_id=inspect(model).identity[0],
-                method_name=method_name, args=args, kwargs=kwargs
-            )
+        return self._method_job(model, method_name, args, kwargs, eager_load)
+
+    def _method_job(self, model, method_name, args, kwargs, eager_load=None):
+        # path and kwargs of the task which executes a model's method
+        if eager_load is None:
+            method = getattr(type(model), method_name, None)
+            eager_load = getattr(method, 'eager_load', ())
+        return 'flask_worker.tasks.execute_method', dict(
+            app_import=self.manager.app_import,
+            worker_cls=type(self), 
+            worker_id=inspect(self).identity[0],
+            model_cls=type(model),
+            model_id=inspect(model).identity[0],
+            method_name=method_name, args=args, kwargs=kwargs,
+            eager_load=tuple(eager_load)
         )
     
     @enqueue
@@ -166,17 +303,147 @@ class WorkerMixin(ModelIdBase):
         \*args, \*\*kwargs :
             Arguments and keyword arguments passed to the function.
 
+        job_queue : str or None, default=None
+            Name of the queue on which the job is enqueued. If `None`, the 
+            worker's `job_queue` is used.
+
         Returns
         -------
         loading_page : str (html)
             The client's loading page.
         """
-        return current_app.task_queue.enqueue(
-            'flask_worker.tasks.execute_func',
-            kwargs=dict(
-                app_import=self.manager.app_import,
-                worker_cls=type(self), 
-                worker_id=inspect(self).identity[0],
-                func=func, args=args, kwargs=kwargs
-            )
-        )
\ No newline at end of file
+        return self._function_job(func, args, kwargs)
+
+    def _function_job(self, func, args, kwargs):
+        # path and kwargs of the task which executes a function
+        return 'flask_worker.tasks.execute_func', dict(
+            app_import=self.manager.app_import,
+            worker_cls=type(self), 
+            worker_id=inspect(self).identity[0],
+            func=func, args=args, kwargs=kwargs
+        )
+
+    def _enqueue_once(self, enqueue_job):
+        """
+        Call `enqueue_job` to enqueue the worker's job, unless the job is 
+        already in progress, and respond to the client.
+
+        Returns
+        -------
+        response : str (html) or flask.Response
+            The client's loading page, a redirect to the `callback` if the 
+            job finished without running (e.g. its result was cached), or 
+            the manager's overload response.
+        """
+        if inspect(self).identity is None:
+            # ensure the worker has an id
+            session = self.manager.db.session
+            session.add(self)
+            session.commit()
+        if not self.job_in_progress:
+            # avoid repeat enqueuing
+            try:
+                enqueue_job()
+            except Overloaded:
+                return self.manager.overloaded(self)
+            self.manager.db.session.commit()
+            if self.job_finished:
+                # skip the loading page
+                return redirect(self.callback)
+        # return the loading page HTML
+        return self.manager.loading_page(self)
+
+    def enqueue_chain(self, steps, job_queue=None):
+        """
+        Enqueue a chain of steps which runs entirely on the server. Each step 
+        is a separate job, enqueued by `rq` once the steps it runs after have 
+        finished, and receives their results. The worker finishes, and emits 
+        `job_finished`, when the last step completes; the last step's result 
+        is the worker's `result`. See `flask_worker.chains`.
+
+        A chain replaces a series of workers whose callbacks enqueue the 
+        next worker, e.g. in a Router, and the client's page load per step.
+
+        Parameters
+        ----------
+        steps : list of flask_worker.Step
+            Steps of the chain. A step may only run after steps listed 
+            before it, and the last step must run after all the others, 
+            directly or through the steps in between.
+
+        job_queue : str or None, default=None
+            Name of the queue on which the steps are enqueued. If `None`, 
+            the worker's `job_queue` is used.
+
+        Returns
+        -------
+        loading_page : str (html)
+            The client's loading page.
+
+        Examples
+        --------
+        ```python
+        class Router(RouterMixin, db.Model):
+            ...
+
+            @set_route
+            def func2(self, url):
+                worker = get_model(Worker, 'report')
+                if worker.job_finished:
+                    return self.func3(worker.result)
+                return worker.enqueue_chain([
+                    Step(download, url), Step(parse), Step(summarize)
+                ])
+        ```
+        """
+        return self._enqueue_once(lambda: self.manager.enqueue_chain(
+            self, steps, queue=job_queue or self.job_queue
+        ))
+
+    def enqueue_map(
+        self, func, iterable, chunk_size=100, reduce=None, job_queue=None
+    ):
+        """
+        Enqueue a function to be mapped over an iterable. The iterable is 
+        split into chunks, which are executed by separate jobs in parallel. 
+        The worker finishes, and emits `job_finished`, when the last chunk 
+        completes. Its progress is the fraction of completed chunks.
+
+        Map jobs track their chunks in Redis, so they require a Redis 
+        connection whichever executor the manager uses.
+
+        Parameters
+        ----------
+        func : callable
+            Function called on each item of the iterable.
+
+        iterable : iterable
+            Items to map over. Items must be picklable.
+
+        chunk_size : int, default=100
+            Maximum number of items per chunk.
+
+        reduce : callable or None, default=None
+            Called once on the list of all results, in the order of the 
+            iterable. Its return value is the worker's `result`. If `None`, 
+            the `result` is the list of results.
+
+        job_queue : str or None, default=None
+            Name of the queue on which the chunks are enqueued. If `None`, 
+            the worker's `job_queue` is used.
+
+        Returns
+        -------
+        loading_page : str (html)
+            The client's loading page.
+
+        Examples
+        --------
+        ```python
+        worker.enqueue_map(score, documents, chunk_size=50, reduce=sum)
+        ```
+        """
+        return self._enqueue_once(lambda: self.manager.enqueue_map(
+            self, func, iterable, chunk_size, reduce, 
+            queue=job_queue or self.job_queue
+        ))
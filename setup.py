@@ -16,7 +16,7 @@ setuptools.setup(
     include_package_data=True,
     install_requires=[
         'flask>=1.1.1',
-        'rq>=1.2.0',
+        'rq>=1.9.0',
         'sqlalchemy>=1.3.12',
         'sqlalchemy-modelid>=0.0.3',
         'sqlalchemy-mutable>=0.0.10',